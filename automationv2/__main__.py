@@ -7,11 +7,23 @@ def cli(debug):
 
 @cli.command()
 @click.option('--port', default=8056)
-def runserver(port):
+@click.option('--threads', default=16, help='Server threads, half of them may hold event streams')
+def runserver(port, threads):
     import waitress
-    from .api.http.server import app
+    from .api.http.server import app, event_hub
 
-    waitress.serve(app, port=port)
+    # each open event stream holds a thread, keep the rest for the UI
+    event_hub.max_subscribers = max(1, threads // 2)
+    waitress.serve(app, port=port, threads=threads)
+
+@cli.command()
+def precompress():
+    '''Writes gzipped sidecars for the static assets served by runserver'''
+    from .api.http.qroutes import precompress_files
+    from .api.http.server import MODULE_DIR
+
+    for path in precompress_files(MODULE_DIR / 'public'):
+        click.echo(path)
 
 if __name__ == '__main__':
     cli()
\ No newline at end of file
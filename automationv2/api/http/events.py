@@ -0,0 +1,191 @@
+'''Publish/subscribe hub streaming procedure progress as server-sent events.
+
+Events are encoded once when published and fanned out to a bounded ring
+buffer per subscriber, so a slow or stalled browser tab only ever loses its
+own oldest events. The hub keeps a history of recent events so a client that
+reconnects with a Last-Event-ID header resumes where it left off.
+
+A WSGI response body holds a server worker while it is iterated, so streams
+end after `linger` seconds and tell the browser to reconnect after `retry`
+milliseconds. EventSource reconnects on its own and sends the id of the last
+event it saw, so no events are lost while a tab is idle and no worker is held
+for longer than `linger`.
+
+At most `max_subscribers` streams are held open, which must stay below the
+server's thread count. Further clients are sent the events they missed and
+told to reconnect after `busy_retry` milliseconds, so they poll without
+holding a worker.
+'''
+import json
+import threading
+import time
+from collections import deque
+
+
+class Event(object):
+    __slots__ = ('id', 'name', 'payload')
+
+    def __init__(self, id, name, data):
+        self.id = id
+        self.name = name
+        lines = ['id: %d' % id, 'event: %s' % name]
+        lines.extend('data: ' + line for line in json.dumps(data, default=str).split('\n'))
+        self.payload = ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class Subscription(object):
+    '''Events waiting to be sent to one client, at most `size` of them'''
+    def __init__(self, size):
+        self.events = deque(maxlen=size)
+        self.dropped = 0
+        # the id the client resumes from, events after it are in `events`
+        self.last_id = None
+
+    def push(self, event):
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+
+
+class EventHub(object):
+    def __init__(self, history=1024, buffer_size=256, max_subscribers=None):
+        self.history = deque(maxlen=history)
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.subscriptions = set()
+        self.condition = threading.Condition()
+        self.last_id = 0
+
+    def publish(self, name, data):
+        with self.condition:
+            self.last_id += 1
+            event = Event(self.last_id, name, data)
+            self.history.append(event)
+            for subscription in self.subscriptions:
+                subscription.push(event)
+            self.condition.notify_all()
+        return event
+
+    def subscribe(self, last_event_id=None):
+        '''Returns a new Subscription, or None if `max_subscribers` are already
+        subscribed. With `last_event_id` it starts with the events in the
+        history published after that id'''
+        subscription = Subscription(self.buffer_size)
+        with self.condition:
+            if self.max_subscribers is not None and len(self.subscriptions) >= self.max_subscribers:
+                return None
+            for event in self.replay(last_event_id):
+                subscription.push(event)
+            subscription.last_id = self.resume_id(last_event_id)
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def resume_id(self, last_event_id=None):
+        '''The id a client resumes from, the latest event for a new client'''
+        return self.last_id if last_event_id is None else last_event_id
+
+    def replay(self, last_event_id=None):
+        '''The events in the history published after `last_event_id`'''
+        if last_event_id is None:
+            return []
+        with self.condition:
+            return [event for event in self.history if event.id > last_event_id]
+
+    def unsubscribe(self, subscription):
+        with self.condition:
+            self.subscriptions.discard(subscription)
+
+    def take(self, subscription, timeout=None):
+        '''Waits up to `timeout` seconds for events and returns all waiting'''
+        with self.condition:
+            self.condition.wait_for(lambda: subscription.events, timeout)
+            events = list(subscription.events)
+            subscription.events.clear()
+        return events
+
+    def stream(self, last_event_id=None, heartbeat=15, linger=60, retry=1000, busy_retry=5000):
+        '''Returns the response body for one client, an EventStream. When the
+        hub is full it is only the events missed since `last_event_id`.
+        Both start with the id to resume from, so a client that had none
+        reconnects with one and misses nothing in between'''
+        subscription = self.subscribe(last_event_id)
+        if subscription is None:
+            with self.condition:
+                resume_id = self.resume_id(last_event_id)
+                missed = self.replay(last_event_id)
+            return [preamble(busy_retry, resume_id) + b''.join(event.payload for event in missed)]
+        return EventStream(self, subscription, heartbeat, linger, retry)
+
+
+def preamble(retry, last_id):
+    '''Sets the reconnection delay and the Last-Event-ID of the client. A
+    message without data is not dispatched but still sets the id'''
+    return ('retry: %d\nid: %d\n\n' % (retry, last_id)).encode('utf-8')
+
+
+class EventStream(object):
+    '''Yields the encoded events of a subscription. A comment is sent after
+    `heartbeat` idle seconds to keep proxies from closing the connection.
+    The server closes the body when the response ends, which unsubscribes
+    even if it was never iterated'''
+    def __init__(self, hub, subscription, heartbeat, linger, retry):
+        self.hub = hub
+        self.subscription = subscription
+        self.heartbeat = heartbeat
+        self.linger = linger
+        self.retry = retry
+
+    def __iter__(self):
+        try:
+            yield preamble(self.retry, self.subscription.last_id)
+            deadline = time.monotonic() + self.linger
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                events = self.hub.take(self.subscription, min(self.heartbeat, remaining))
+                if events:
+                    yield b''.join(event.payload for event in events)
+                else:
+                    yield b': heartbeat\n\n'
+        finally:
+            self.close()
+
+    def close(self):
+        self.hub.unsubscribe(self.subscription)
+
+
+class HubObserver(object):
+    '''Observer publishing procedure events to an EventHub'''
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, event, args, kwargs):
+        data = dict(kwargs)
+        if args:
+            data['args'] = args
+        self.hub.publish(event, data)
+
+    # ObserverManager passes the observer as the first argument
+    def on_procedure_begin(self, observer, *args, **kwargs):   self.publish('procedure_begin', args, kwargs)
+    def on_step_start(self, observer, *args, **kwargs):        self.publish('step_start', args, kwargs)
+    def on_step_end(self, observer, *args, **kwargs):          self.publish('step_end', args, kwargs)
+    def on_procedure_end(self, observer, *args, **kwargs):     self.publish('procedure_end', args, kwargs)
+    def on_comment(self, observer, *args, **kwargs):           self.publish('comment', args, kwargs)
+
+
+def last_event_id(request):
+    try:
+        return int(request['headers'].get('Last-Event-Id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def sse_handler(hub, heartbeat=15, linger=60, retry=1000):
+    def handler(request):
+        return {'status': 200,
+                'headers': [('Content-Type', 'text/event-stream'),
+                            ('Cache-Control', 'no-cache'),
+                            ('X-Accel-Buffering', 'no')],
+                'body': hub.stream(last_event_id(request), heartbeat, linger, retry)}
+    return handler
@@ -1,5 +1,9 @@
 import os, subprocess
+import hashlib
 import json
+import threading
+import time
+import zlib
 from urllib.parse import parse_qs
 
 from . import config
@@ -52,18 +56,161 @@ def get_treedata(root, virtual_root, unix_style=True, is_root=False):
  
     return treedata
   
+class TreeIndex(object):
+    '''Cached index of the folders and files below a set of roots, served in
+    the same flat `path -> node` form as `get_treedata`.
+
+    Each directory listing is kept along with the directory's mtime. A
+    refresh only stats directories and re-lists the ones whose mtime changed,
+    so an unchanged tree costs one `stat` per folder and no listing at all.
+    Refreshes are throttled to `refresh_interval` seconds. `version` is bumped
+    whenever the served tree changes. ETags are built from a digest of the
+    served nodes, so they stay valid across restarts and differ between trees.
+    '''
+    def __init__(self, roots, virtual_root='rvt', refresh_interval=1.0):
+        self.roots = roots
+        self.virtual_root = virtual_root
+        self.refresh_interval = refresh_interval
+        self.listings = {}
+        self.nodes = {}
+        self.version = 0
+        self.digest = None
+        self.last_refresh = None
+        self.lock = threading.Lock()
+
+    def list_dir(self, path):
+        "Returns (files, dirs) for path, re-listing only if its mtime changed"
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        cached = self.listings.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2], False
+
+        files, dirs = [], []
+        if mtime is not None:
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        (dirs if is_dir else files).append(entry.name)
+            except OSError:
+                pass
+        self.listings[path] = (mtime, files, dirs)
+        return files, dirs, True
+
+    def scan(self, root, virtual_root, seen, nodes=None, is_root=False):
+        """Walks the cached listings below root, re-listing changed directories.
+        Returns True if any listing changed. Fills nodes when one is given."""
+        files, dirs, changed = self.list_dir(root)
+        seen.add(os.path.realpath(root))
+
+        if nodes is not None:
+            folder = {
+                'path': virtual_root,
+                'type': 'folder',
+                'children': files + dirs
+            }
+            if is_root:
+                folder['isRoot'] = True
+            nodes[virtual_root] = folder
+
+            for name in files:
+                path = virtual_root + '/' + name
+                nodes[path] = {'path': path, 'type': 'file'}
+
+        for dirname in dirs:
+            real = os.path.join(root, dirname)
+            # guard against symlink cycles
+            if os.path.realpath(real) in seen:
+                continue
+            changed |= self.scan(real, virtual_root + '/' + dirname, seen, nodes)
+        return changed
+
+    def refresh(self, force=False):
+        "Re-stats the tree and rebuilds the nodes if anything changed"
+        with self.lock:
+            now = time.monotonic()
+            if (not force and self.last_refresh is not None and
+                now - self.last_refresh < self.refresh_interval):
+                return self.version
+            self.last_refresh = now
+
+            seen = set()
+            changed = self.version == 0
+            for root in self.roots:
+                changed |= self.scan(root, self.virtual_root, seen)
+
+            # forget listings of directories that are no longer in the tree
+            for path in [p for p in self.listings if os.path.realpath(p) not in seen]:
+                del self.listings[path]
+                changed = True
+
+            if changed:
+                nodes = {}
+                for root in self.roots:
+                    self.scan(root, self.virtual_root, set(), nodes, is_root=True)
+                self.nodes = nodes
+                self.digest = hashlib.sha1(json.dumps(nodes).encode('utf-8')).hexdigest()[:16]
+                self.version += 1
+            return self.version
+
+    def subtree(self, path=None, depth=None):
+        "Returns the flat nodes at and below path, limited to depth levels"
+        nodes = self.nodes
+        if path is None:
+            path = self.virtual_root
+        if path == self.virtual_root and depth is None:
+            return dict(nodes)
+
+        result = {}
+        pending = [(path, 0)]
+        while pending:
+            path, level = pending.pop()
+            node = nodes.get(path)
+            if node is None:
+                continue
+            result[path] = node
+            if node['type'] == 'folder' and (depth is None or level < depth):
+                pending.extend((path + '/' + name, level + 1)
+                               for name in reversed(node['children']))
+        return result
+
+    def etag(self, path=None, depth=None):
+        query = '%s:%s' % (path, depth)
+        return '"%s-%08x"' % (self.digest, zlib.crc32(query.encode('utf-8')))
+
+rvt_index = TreeIndex(config.rvt_paths)
+
 def rvt_tree_handler(request):
-    print(config.rvt_paths)
+    query = parse_qs(request.get('query-string', ''))
+    path = query.get('path', [None])[0]
+    depth = query.get('depth', [None])[0]
+    depth = int(depth) if depth is not None and depth.isdigit() else None
+
+    rvt_index.refresh()
+    etag = rvt_index.etag(path, depth)
+    headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+
+    if request.get('headers', {}).get('If-None-Match') == etag:
+        return {
+            'status': 304,
+            'headers': headers
+        }
 
-    data = []
-    for root in config.rvt_paths:
-        data += get_treedata(root, 'rvt', is_root=True)
-    tree_data = {node['path']:node for node in data}
+    tree_data = rvt_index.subtree(path, depth)
+    if path is not None and not tree_data:
+        return { 'status': 404 }
 
     return {
         'status': 200,
-        'headers': [('Content-Type', 'application/json')],
-        'body': tree_data  
+        'headers': [('Content-Type', 'application/json')] + headers,
+        'body': tree_data
     }
 
 def get_file(request):
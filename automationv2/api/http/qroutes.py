@@ -1,7 +1,11 @@
 import re
 import json
 import os
+import stat
+import functools
 import mimetypes
+from collections.abc import MutableMapping
+from email.utils import formatdate, parsedate_to_datetime
 
 try:
     import urlparse
@@ -103,6 +107,101 @@ def route_compile(path, regexs=dict()):
                          build_route_regex(path, regexs), 
                          path_keys)
 
+def is_literal_segment(segment):
+    "True if a path segment has no :param or * and so can be matched by equality"
+    return not find_path_keys(segment)
+
+class RouteNode(object):
+    def __init__(self):
+        self.children = {}
+        # method -> [(index, route)] for literal routes ending at this node
+        self.exact = {}
+        # method -> [(index, route)] for routes whose remaining path is dynamic
+        self.dynamic = {}
+
+class RouteDispatcher(object):
+    '''Prefix tree over the literal segments of each route's path, keyed by
+    HTTP method at each node. Routes are descended for as long as their
+    segments are literal. The first segment holding a :param or * parks the
+    route on that node and only those routes fall back to regex matching.
+
+    Candidates are returned in registration order so that a handler returning
+    None still falls through to the next matching route.
+
+    >>> d = RouteDispatcher()
+    >>> d.add(GET('/api/home', 'home'))
+    >>> d.add(GET('/api/:id', 'item'))
+    >>> d.add(GET('/*', 'static'))
+    >>> [(r['handler'], p) for r, p in d.matches({'request-method': 'GET', 'uri': '/api/home'})]
+    [('home', {}), ('item', {'id': 'home'}), ('static', {'*': 'api/home'})]
+    >>> [r['handler'] for r, p in d.matches({'request-method': 'POST', 'uri': '/api/home'})]
+    []
+    '''
+    def __init__(self):
+        self.root = RouteNode()
+        self.size = 0
+
+    def add(self, route):
+        path = route.get('full_path', route['path'])
+        if 'compiled' not in route:
+            route['compiled'] = route_compile(path)
+
+        node = self.root
+        table = None
+        for segment in path.split('/'):
+            if not is_literal_segment(segment):
+                table = node.dynamic
+                break
+            node = node.children.setdefault(segment, RouteNode())
+        if table is None:
+            table = node.exact
+
+        table.setdefault(route.get('method', None), []).append((self.size, route))
+        self.size += 1
+
+    @staticmethod
+    def methods(request):
+        request_method = request.get('request-method')
+        if request_method == 'HEAD':
+            return (None, 'HEAD', 'GET')
+        return (None, request_method)
+
+    def candidates(self, request):
+        "Returns the (index, route) pairs that may match the request in registration order"
+        methods = self.methods(request)
+        segments = request.get('uri').split('/')
+        found = []
+
+        def collect(table):
+            for method in methods:
+                found.extend(table.get(method, ()))
+
+        # Walk the path with a trailing slash added to mirror CompiledRoute
+        node = self.root
+        last = len(segments) - 1
+        for i, segment in enumerate(segments + ['']):
+            collect(node.dynamic)
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if i >= last:
+                collect(node.exact)
+        else:
+            collect(node.dynamic)
+
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+    def matches(self, request):
+        "Yields (route, params) for every route matching the request in order"
+        for _, route in self.candidates(request):
+            if route['compiled'].keys:
+                params = route['compiled'].route_matches(request)
+                if params is not None:
+                    yield route, params
+            else:
+                yield route, {}
+
 ################################################################################
 # RESPONSE HELPERS 
 ################################################################################
@@ -216,17 +315,18 @@ def site_handler(routes=[], default_handler=None):
     for route in routes:
         build_routes(complete_routes, route)
 
+    dispatcher = RouteDispatcher()
+    for route in complete_routes:
+        dispatcher.add(route)
+
     def router_handler(request):
-        for route in complete_routes:
-            if method_matches(request, route.get('method', None)):
-                route_params = route['compiled'].route_matches(request)
-                if route_params is not None:
-                   request['params'] = route_params
-                   request['context'] = route['context']
-                   request['path-info'] = request['path-info'][len(route['context']):] 
-                   response = route['handler'](request)
-                   if response is not None:
-                       return response
+        for route, route_params in dispatcher.matches(request):
+            request['params'] = route_params
+            request['context'] = route['context']
+            request['path-info'] = request['path-info'][len(route['context']):]
+            response = route['handler'](request)
+            if response is not None:
+                return response
         if default_handler is not None:
             return default_handler(request)
         else:
@@ -236,16 +336,135 @@ def site_handler(routes=[], default_handler=None):
 class UnknownHTTPStatus(Exception):
     pass
 
+ring_keys = {
+    'server-port': 'SERVER_PORT',
+    'server-name': 'SERVER_NAME',
+    'remote-addr': 'REMOTE_ADDR',
+    'uri': 'PATH_INFO',
+    'path-info': 'PATH_INFO',
+    'query-string': 'QUERY_STRING',
+    'scheme': 'wsgi.url_scheme',
+    'request-method': 'REQUEST_METHOD',
+    'protocol': 'SERVER_PROTOCOL',
+}
+
+# headers without the HTTP_ prefix in the environ
+special_headers = {'CONTENT_TYPE': 'Content-Type', 'CONTENT_LENGTH': 'Content-Length'}
+
+# environ keys a ring request exposes under another name
+remapped_keys = set(ring_keys.values()) | set(special_headers)
+
+@functools.lru_cache(maxsize=512)
+def header_name(key):
+    "HTTP_ACCEPT_ENCODING -> Accept-Encoding"
+    return special_headers.get(key) or '-'.join([w.capitalize() for w in key[5:].split('_')])
+
+def is_header(key):
+    return key.startswith('HTTP_') or key in special_headers
+
+def environ_headers(environ):
+    return {header_name(k): v for k, v in environ.items() if is_header(k)}
+
+def read_body(environ):
+    '''Reads Content-Length bytes of the request body. Without a length there
+    is no body, reading until EOF could block on a keep-alive connection'''
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    stream = environ.get('wsgi.input')
+    if stream is None or length <= 0:
+        return b''
+    return stream.read(length)
+
+def parse_query_params(request):
+    query_string_list = urlparse.parse_qsl(request.get('query-string', ''))
+    return {'query-params-list': query_string_list,
+            'query-params': dict(query_string_list)}
+
+class Request(MutableMapping):
+    '''Ring request backed by the wsgi environ.
+
+    The ring keys are read straight from the environ and headers, query params
+    and body are only computed when a handler first looks at them. Assigned
+    keys are kept on the request, the environ is never changed. Iterating, and
+    so copying, the request leaves out a body that has not been read.
+    '''
+    __slots__ = ('environ', 'values')
+
+    # keys computed on first access
+    lazy = {
+        'headers': lambda request: {'headers': environ_headers(request.environ)},
+        'query-params': parse_query_params,
+        'query-params-list': parse_query_params,
+        'body': lambda request: {'body': read_body(request.environ)},
+    }
+
+    def __init__(self, environ):
+        self.environ = environ
+        self.values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        if key in ring_keys:
+            return self.environ[ring_keys[key]]
+        if key in self.lazy:
+            self.values.update(self.lazy[key](self))
+            return self.values[key]
+        if key in remapped_keys or is_header(key):
+            raise KeyError(key)
+        return self.environ[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if key in self.values or key in self.lazy:
+            return True
+        if key in ring_keys:
+            return ring_keys[key] in self.environ
+        return key in self.environ and key not in remapped_keys and not is_header(key)
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+    def __delitem__(self, key):
+        # only assigned or computed keys can be removed
+        del self.values[key]
+
+    def __iter__(self):
+        keys = dict.fromkeys(self.values)
+        # listing the body would read it on every copy of the request, it is
+        # only listed once read or assigned
+        keys.update(dict.fromkeys(k for k in self.lazy if k != 'body'))
+        keys.update(dict.fromkeys(ring for ring, wsgi in ring_keys.items() if wsgi in self.environ))
+        keys.update(dict.fromkeys(k for k in self.environ
+                                  if k not in remapped_keys and not is_header(k)))
+        return iter(keys)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '<Request %s %s>' % (self.get('request-method'), self.get('uri'))
+
 def wsgi_environ_to_ring_request(environ):
-    '''Convert wsgi environment to a ring request
+    '''Convert wsgi environment to a ring request, a dict with a copy of every
+    value. wsgi_adapter uses the lazy Request instead
 
     '''
     ring_request = {}
     remapped = set()
 
-    if 'wsgi.input' in ring_request:
-        ring_request['body'] = ring_request['wsgi.input'].read()
-        del ring_request['wsgi.input']
+    if 'wsgi.input' in environ:
+        ring_request['body'] = read_body(environ)
+        remapped.add('wsgi.input')
 
     mappings = [
         ('SERVER_PORT', 'server-port'),
@@ -291,7 +510,7 @@ def wsgi_adapter(handler):
     
     '''
     def wsgi_handler(environ, start_response):
-        request = wsgi_environ_to_ring_request(environ)
+        request = Request(environ)
         response = handler(request)
         status = 200
         headers = []
@@ -323,14 +542,198 @@ def wrap_query_params(handler):
     including duplicate keys, and a dictionary that will not maintain order
     and only contain the last query param on duplicates 
 
+    A lazy Request already parses them on first access.
+
     '''
     def query_params(request):
-         query_string_list = urlparse.parse_qsl(request.get('query-string', ''))
-         request['query-params-list'] = query_string_list
-         request['query-params'] = dict(query_string_list)
+         if 'query-params' not in request:
+             request.update(parse_query_params(request))
          return handler(request)
     return query_params
 
+class RequestBodyError(ValueError):
+    '''A malformed request body, a ValueError so handlers parsing the body
+    handle it with their own errors. `status` is the response status'''
+    status = 400
+
+class RequestBodyTooLarge(RequestBodyError):
+    status = 413
+
+class BodyReader(object):
+    '''Reads a request body from `wsgi.input` in chunks of at most
+    `chunk_size` bytes, never past Content-Length. Without a length the body
+    is read until EOF, which servers only allow with `wsgi.input_terminated`.
+
+    Bodies longer than `max_size` raise RequestBodyTooLarge. Reading the whole
+    body at once, which `json` and `read()` do, is further limited to
+    `max_memory` bytes, uploads larger than that are read with `chunks`.
+    Lines are iterated like a file, and `json_lines` parses newline delimited
+    JSON one line at a time, the way to send bulk data.
+    '''
+    def __init__(self, stream, length=None, max_size=None, max_memory=None,
+                 chunk_size=64 * 1024):
+        self.stream = stream
+        self.length = length
+        self.max_size = max_size
+        self.max_memory = max_memory
+        self.chunk_size = chunk_size
+        self.consumed = 0
+        self.buffer = b''
+        self.eof = length == 0
+        if too_large(length, max_size):
+            raise RequestBodyTooLarge('Request body of %d bytes is larger than %d' % (length, max_size))
+
+    @classmethod
+    def from_request(cls, request, **kwargs):
+        stream = request.get('wsgi.input')
+        if stream is None:
+            # already read, e.g. by wsgi_environ_to_ring_request
+            body = request.get('body') or b''
+            return cls(BytesIO(body), len(body), **kwargs)
+
+        content_length = request.get('headers', {}).get('Content-Length')
+        try:
+            length = int(content_length) if content_length else None
+        except ValueError:
+            raise RequestBodyError('Invalid Content-Length %r' % content_length)
+        if length is not None and length < 0:
+            raise RequestBodyError('Invalid Content-Length %r' % content_length)
+
+        if length is None and not request.get('wsgi.input_terminated'):
+            # without a length reading could block on a keep-alive connection
+            return cls(BytesIO(b''), 0, **kwargs)
+        return cls(stream, length, **kwargs)
+
+    def read_chunk(self, size=None):
+        '''Reads at most `size` bytes from the stream, b'' at the end of the body'''
+        if self.eof:
+            return b''
+        size = self.chunk_size if size is None else min(size, self.chunk_size)
+        if self.length is not None:
+            size = min(size, self.length - self.consumed)
+        chunk = self.stream.read(size)
+        self.consumed += len(chunk)
+        if not chunk:
+            self.eof = True
+            if self.length is not None and self.consumed < self.length:
+                raise RequestBodyError('Request body ended after %d of %d bytes' % (self.consumed, self.length))
+        elif self.consumed == self.length:
+            self.eof = True
+        if too_large(self.consumed, self.max_size):
+            raise RequestBodyTooLarge('Request body is larger than %d bytes' % self.max_size)
+        return chunk
+
+    def chunks(self):
+        '''Yields the rest of the body in chunks of at most `chunk_size` bytes'''
+        if self.buffer:
+            chunk, self.buffer = self.buffer, b''
+            yield chunk
+        while True:
+            chunk = self.read_chunk()
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.read_all()
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        while len(data) < size:
+            chunk = self.read_chunk(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read_all(self):
+        if self.length is not None and too_large(self.length - self.consumed + len(self.buffer), self.max_memory):
+            raise RequestBodyTooLarge('Request body is larger than %d bytes, stream it' % self.max_memory)
+        data = []
+        size = 0
+        for chunk in self.chunks():
+            size += len(chunk)
+            if too_large(size, self.max_memory):
+                raise RequestBodyTooLarge('Request body is larger than %d bytes, stream it' % self.max_memory)
+            data.append(chunk)
+        return b''.join(data)
+
+    def readline(self, size=-1):
+        while b'\n' not in self.buffer and not self.eof:
+            if too_large(len(self.buffer), self.max_memory):
+                raise RequestBodyTooLarge('Request body line is longer than %d bytes' % self.max_memory)
+            self.buffer += self.read_chunk()
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def json(self):
+        '''Parses the body as one JSON document. The document is read whole,
+        within `max_memory`, as the json module has no incremental parser'''
+        data = self.read()
+        try:
+            return json.loads(data.decode('utf-8'))
+        except ValueError as e:
+            raise RequestBodyError('Invalid JSON body: %s' % e)
+
+    def json_lines(self):
+        '''Yields the value of each line of a newline delimited JSON body as
+        it is read, only one line is held in memory at a time'''
+        for number, line in enumerate(self, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                raise RequestBodyError('Invalid JSON on line %d: %s' % (number, e))
+
+    def form_items(self):
+        '''Yields the (name, value) pairs of a urlencoded form as they are
+        read, only one field is held in memory at a time'''
+        pending = b''
+        for chunk in self.chunks():
+            pending += chunk
+            *fields, pending = pending.split(b'&')
+            for field in fields:
+                yield from urlparse.parse_qsl(field.decode('utf-8'))
+            if too_large(len(pending), self.max_memory):
+                raise RequestBodyTooLarge('Form field is longer than %d bytes' % self.max_memory)
+        yield from urlparse.parse_qsl(pending.decode('utf-8'))
+
+    def form(self):
+        '''The form as a dict, the last value wins on duplicate names'''
+        return dict(self.form_items())
+
+def too_large(size, limit):
+    return size is not None and limit is not None and size > limit
+
+def wrap_request_body(handler, max_size=1 << 30, max_memory=16 << 20, chunk_size=64 * 1024):
+    '''Puts a BodyReader for the request body in 'body'. Nothing is read until
+    the handler reads it. Requests with a body over `max_size` bytes, or that
+    read more than `max_memory` bytes at once, get a 413 response and
+    malformed bodies a 400
+
+    '''
+    def request_body(request):
+        try:
+            request['body'] = BodyReader.from_request(request, max_size=max_size,
+                                                      max_memory=max_memory, chunk_size=chunk_size)
+            return handler(request)
+        except RequestBodyError as e:
+            return {'status': e.status,
+                    'headers': [('Content-Type', 'text/plain; charset=utf-8')],
+                    'body': str(e).encode('utf-8')}
+    return request_body
+
 def wrap_json_response(handler):
     '''Converts body to json if headers indicate json
 
@@ -371,7 +774,8 @@ def wrap_config(handler, config):
         return handler(request)
     return config_handler
 
-# Gzip
+# Compression
+import zlib
 from gzip import GzipFile
 from wsgiref.headers import Headers
 import re
@@ -381,6 +785,16 @@ try:
 except:
     from cStringIO import StringIO
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 # Precompile the regex to check for gzip headers
 re_accepts_gzip = re.compile(r'\bgzip\b')
@@ -388,6 +802,10 @@ re_accepts_gzip = re.compile(r'\bgzip\b')
 # Precompile the regex to split a comma delimitered string of Vary headers
 cc_delim_re = re.compile(r'\s*,\s*')
 
+# Only these content types are worth compressing. Images, archives and
+# anything already compressed are passed through untouched.
+re_compressible = re.compile(r'^(text/|application/(.*\+)?(json|xml|javascript|x-javascript|ecmascript)\b|image/svg\+xml)')
+
 
 def gzip_buffer(string, compression_level=6):
     """gzips a string."""
@@ -405,6 +823,28 @@ def client_accepts_gzip(environ):
     return re_accepts_gzip.search(accept_header)
 
 
+def accepted_encodings(accept_header):
+    '''Parses an Accept-Encoding header into a dict of encoding to q-value
+
+    >>> accepted_encodings('gzip, br;q=0.5, zstd;q=0')
+    {'gzip': 1.0, 'br': 0.5, 'zstd': 0.0}
+    '''
+    encodings = {}
+    for part in cc_delim_re.split(accept_header.strip()):
+        if not part:
+            continue
+        name, _, params = part.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[name.strip().lower()] = q
+    return encodings
+
+
 def patch_vary_headers(headers, new_values):
     """Patches any existing Vary headers to add new_values to it.  Returns
     nothing, but modifies the headers array in-place.
@@ -420,78 +860,185 @@ def patch_vary_headers(headers, new_values):
     headers['Vary'] = ', '.join(vary_headers + additional_values)
 
 
-class GzipMiddleware(object):
-    """The actual WSGI middleware to wrap around your app and gzip all output.
-    This automatically adds the required HTTP headers.
+class GzipEncoder(object):
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder(object):
+    name = 'br'
+
+    def __init__(self, level):
+        # brotli quality runs 0-11, scale the zlib style 1-9 level onto it
+        self.compressor = brotli.Compressor(quality=min(11, max(0, level + 2)))
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdEncoder(object):
+    name = 'zstd'
+
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+def available_encoders():
+    "Encoders in server preference order. brotli and zstd only if importable"
+    encoders = []
+    if brotli is not None:
+        encoders.append(BrotliEncoder)
+    if zstandard is not None:
+        encoders.append(ZstdEncoder)
+    encoders.append(GzipEncoder)
+    return encoders
+
+
+class CompressionMiddleware(object):
+    """WSGI middleware that compresses responses as the app yields them.
+
+    Each chunk is fed through a streaming compressor so nothing is buffered
+    beyond what the compressor holds. Server-sent event streams are flushed
+    at every event boundary so clients see events immediately. Responses that
+    already have a Content-Encoding, carry a Content-Range, are smaller than
+    `minimum_size` or have an incompressible content type are passed through
+    untouched, which also keeps `wsgi.file_wrapper` bodies eligible for
+    sendfile.
+
+    The encoding is negotiated from Accept-Encoding. brotli and zstd are
+    offered only when their modules are importable.
+
+    Compressed responses get the encoding appended to their ETag. It is
+    stripped again from If-None-Match before the app sees it, so the app's
+    conditional GET still matches.
     """
-    def __init__(self, app, compresslevel=6):
+    def __init__(self, app, compresslevel=6, minimum_size=200, encoders=None):
         self.app = app
         self.compresslevel = compresslevel
+        self.minimum_size = minimum_size
+        self.encoders = encoders if encoders is not None else available_encoders()
+        self.re_encoded_etag = re.compile(
+            ';(%s)"' % '|'.join(re.escape(encoder.name) for encoder in self.encoders))
+
+    def negotiate(self, environ):
+        accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        default_q = accepted.get('*', 0.0)
+        best, best_q = None, 0.0
+        for encoder in self.encoders:
+            q = accepted.get(encoder.name, default_q)
+            if q > best_q:
+                best, best_q = encoder, q
+        return best
+
+    def should_compress(self, status, headers, environ):
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return False
+        code = status.split(' ', 1)[0]
+        if code in ('204', '206', '304') or code.startswith('1'):
+            return False
+        if 'content-encoding' in headers or 'content-range' in headers:
+            return False
+        if not re_compressible.match(headers.get('content-type', '')):
+            return False
+        length = headers.get('content-length')
+        if length is not None and length.isdigit() and int(length) < self.minimum_size:
+            return False
+        return True
 
     def __call__(self, environ, start_response):
-        if not client_accepts_gzip(environ):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH', '')
+        encoded_match = self.re_encoded_etag.search(if_none_match)
+        if encoded_match:
+            environ = dict(environ, HTTP_IF_NONE_MATCH=self.re_encoded_etag.sub('"', if_none_match))
+
+        encoder = self.negotiate(environ)
+        if encoder is None:
             return self.app(environ, start_response)
 
-        def collect_response(response):
-            """Intercepts the response from the WSGI app, and stores the
-            output in the given response dict for later inspection.
-            """
-            def _intercept_response(status, headers, *args, **kwargs):
-                response['status'] = status
-                response['headers'] = headers
+        state = {}
 
-            return _intercept_response
+        def intercept_response(status, response_headers, exc_info=None):
+            headers = Headers(response_headers)
+            if self.should_compress(status, headers, environ):
+                state['encoder'] = encoder(self.compresslevel)
+                state['event-stream'] = headers.get('content-type', '').startswith('text/event-stream')
 
-        def to_bytes(s):
-            if isinstance(s, str):
-                return s.encode('utf-8')
+                del headers['Content-Length']
+                del headers['Accept-Ranges']
+                headers['Content-Encoding'] = encoder.name
+                if 'ETag' in headers:
+                    headers['ETag'] = re.sub('"$', ';%s"' % encoder.name, headers['ETag'])
+                patch_vary_headers(headers, ('Accept-Encoding',))
             else:
-                return s
-
-        # Now get the raw response from the WSGI app
-        app_response = {}
-
+                state['encoder'] = None
+                # keep the ETag the client validated with
+                if (status.startswith('304') and 'ETag' in headers and
+                        encoded_match and encoded_match.group(1) == encoder.name):
+                    headers['ETag'] = re.sub('"$', ';%s"' % encoder.name, headers['ETag'])
+            if exc_info is not None:
+                return start_response(status, response_headers, exc_info)
+            return start_response(status, response_headers)
+
+        iterable = self.app(environ, intercept_response)
+        if 'encoder' in state and state['encoder'] is None:
+            return iterable
+        return self.compress(iterable, state)
+
+    def compress(self, iterable, state):
         try:
-            iterable = self.app(environ, collect_response(app_response))
-
-            # encode strings to utf-8
-            raw_response = b''.join(to_bytes(s) for s in iterable)
-
-            def pass_through(app_response, raw_response):
-                start_response(app_response['status'], app_response['headers'])
-                return [raw_response]
-
-            headers = Headers(app_response['headers'])
-            if 'content-encoding' in headers:
-                # Since there already is a content encoding, apparently, we just
-                # return the respons without compression
-                return pass_through(app_response, raw_response)
-
-            # Perform the gzip
-            buflen = len(raw_response)
-            if buflen <= 200:
-                return pass_through(app_response, raw_response)
-            gzipped_response = gzip_buffer(raw_response)
-
-            # Last check: only send the response if it's actually shorter
-            if len(gzipped_response) >= buflen:
-                return pass_through(app_response, raw_response)
-            del raw_response  # garbage collect early
-
-            # Set headers accordingly
-            headers['Content-Encoding'] = 'gzip'
-            headers['Content-Length'] = str(len(gzipped_response))
-            if 'ETag' in headers:
-                headers['ETag'] = re.sub('"$', ';gzip"', headers['ETag'])
-            patch_vary_headers(headers, ('Accept-Encoding',))
-
-            # Send the headers and the contents
-            start_response(app_response['status'], app_response['headers'])
-            return [gzipped_response]
+            for chunk in iterable:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+
+                encoder = state.get('encoder')
+                if encoder is None:
+                    yield chunk
+                    continue
+
+                data = encoder.compress(chunk)
+                if state['event-stream'] and chunk.endswith(b'\n\n'):
+                    data += encoder.flush()
+                if data:
+                    yield data
+
+            if state.get('encoder') is not None:
+                yield state['encoder'].finish()
         finally:
             if hasattr(iterable, 'close'):
                 iterable.close()
 
+
+class GzipMiddleware(CompressionMiddleware):
+    """Streaming compression restricted to gzip."""
+    def __init__(self, app, compresslevel=6, minimum_size=200):
+        super().__init__(app, compresslevel, minimum_size, encoders=[GzipEncoder])
+
 ################################################################################
 # Response
 ################################################################################
@@ -510,9 +1057,10 @@ def redirect(path, code=301):
     return redirect_handler
 
 class FileWrapper(object):
-    def __init__(self, file, buffer_size=8192):
+    def __init__(self, file, buffer_size=8192, length=None):
         self.file = file
         self.buffer_size = buffer_size
+        self.remaining = length
 
     def close(self):
         if hasattr(self.file, 'close'):
@@ -525,8 +1073,15 @@ class FileWrapper(object):
         return self.__next__()
 
     def __next__(self):
-        data = self.file.read(self.buffer_size)
+        size = self.buffer_size
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+            if size <= 0:
+                raise StopIteration()
+        data = self.file.read(size)
         if data:
+            if self.remaining is not None:
+                self.remaining -= len(data)
             return data
         raise StopIteration()
 
@@ -542,55 +1097,252 @@ extended_mimes = {
     'js':  'application/x-javascript'
 }
 
-def file_response(path, defaultType=default_mime):
-    def response(request):
-        extension = path.split('.')[-1]
-        guessed_type = mimetypes.guess_type(path)
-        mime_type = extended_mimes.get(extension, guessed_type[0] or defaultType) 
-        file = open(path, 'rb')
-        file_size = os.path.getsize(path)
-        headers = [('Content-Type', mime_type),
-                   ('Content-Length', str(file_size)),
-                   ('Cache-Control', 'public')]
+@functools.lru_cache(maxsize=1024)
+def guess_mime(path, defaultType=default_mime):
+    "Mime type for path. Cached so repeated hits skip `mimetypes.guess_type`"
+    extension = path.split('.')[-1]
+    guessed_type = mimetypes.guess_type(path)
+    return extended_mimes.get(extension, guessed_type[0] or defaultType)
+
+@functools.lru_cache(maxsize=1024)
+def file_validators(path, mtime_ns, size):
+    "ETag and Last-Modified for one version of a file, cached by its stat"
+    etag = '"%x-%x"' % (mtime_ns, size)
+    return etag, formatdate(mtime_ns / 1e9, usegmt=True)
+
+def stat_file(path):
+    "Returns the stat of path if it is a regular file else None"
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+def not_modified(request, etag, mtime):
+    '''Checks the conditional headers of a request against the file validators
+
+    >>> not_modified({'headers': {'If-None-Match': '"a", "b"'}}, '"b"', 0)
+    True
+    >>> not_modified({'headers': {'If-Modified-Since': 'Sat, 01 Jan 2000 00:00:00 GMT'}}, '"b"', 946684800.5)
+    True
+    >>> not_modified({'headers': {'If-Modified-Since': 'Sat, 01 Jan 2000 00:00:00 GMT'}}, '"b"', 946684801)
+    False
+    '''
+    headers = request.get('headers', {})
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return False
+        return int(mtime) <= since
+    return False
+
+range_pattern = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def requested_range(request, size, etag, last_modified):
+    '''Parses a single byte range from the Range header. Returns None to send
+    the whole file, an inclusive (start, end) tuple, or False if the range
+    cannot be satisfied
+
+    >>> requested_range({'headers': {'Range': 'bytes=0-99'}}, 1000, '"a"', '')
+    (0, 99)
+    >>> requested_range({'headers': {'Range': 'bytes=-100'}}, 1000, '"a"', '')
+    (900, 999)
+    >>> requested_range({'headers': {'Range': 'bytes=900-'}}, 1000, '"a"', '')
+    (900, 999)
+    >>> requested_range({'headers': {'Range': 'bytes=1000-'}}, 1000, '"a"', '')
+    False
+    >>> requested_range({'headers': {'Range': 'bytes=0-1', 'If-Range': '"b"'}}, 1000, '"a"', '')
+    '''
+    headers = request.get('headers', {})
+    range_header = headers.get('Range')
+    if range_header is None:
+        return None
+
+    # A stale If-Range means the client wants the whole, current file
+    if_range = headers.get('If-Range')
+    if if_range is not None and if_range not in (etag, last_modified):
+        return None
+
+    # Multiple ranges are not supported. Sending the whole file is allowed.
+    matcher = range_pattern.match(range_header.strip())
+    if not matcher:
+        return None
+
+    start, end = matcher.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        length = int(end)
+        if length == 0:
+            return False
+        start, end = max(0, size - length), size - 1
+    else:
+        start = int(start)
+        end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or start > end:
+        return False
+    return start, end
+
+def precompressed_file(request, path, st):
+    '''Returns (path, stat) of the gzipped sidecar `path + '.gz'` when it
+    exists, is no older than the file with stat `st` and the client accepts
+    gzip, otherwise None. A file edited since `precompress_files` last ran
+    is served as is rather than from its stale sidecar
+
+    '''
+    accepted = accepted_encodings(request.get('headers', {}).get('Accept-Encoding', ''))
+    if accepted.get('gzip', accepted.get('*', 0.0)) <= 0:
+        return None
+    gz_path = path + '.gz'
+    gz_st = stat_file(gz_path)
+    if gz_st is None or gz_st.st_mtime_ns < st.st_mtime_ns:
+        return None
+    return gz_path, gz_st
+
+def static_file_response(request, path, st, mime_type, precompressed=False):
+    '''Builds the response for a file that has already been stat'ed.
+    Conditional requests are answered with 304 before the file is opened.
+    Whole files are handed to the server's `wsgi.file_wrapper`, when it
+    provides one, so the server can use sendfile.
+
+    With `precompressed` a gzipped `.gz` sidecar is served in place of the
+    file to clients that accept gzip, so compression costs nothing per request.
+
+    '''
+    encoding = None
+    if precompressed:
+        sidecar = precompressed_file(request, path, st)
+        if sidecar is not None:
+            path, st = sidecar
+            encoding = 'gzip'
+
+    etag, last_modified = file_validators(path, st.st_mtime_ns, st.st_size)
+    headers = [('Content-Type', mime_type),
+               ('Cache-Control', 'public'),
+               ('ETag', etag),
+               ('Last-Modified', last_modified),
+               ('Accept-Ranges', 'bytes')]
+    if precompressed:
+        headers.append(('Vary', 'Accept-Encoding'))
+    if encoding is not None:
+        headers.append(('Content-Encoding', encoding))
+
+    if not_modified(request, etag, st.st_mtime):
+        # the validators and Vary, a cache stores the 304 under the same variants
+        return {
+            'status': 304,
+            'headers': [(name, value) for name, value in headers
+                        if name in ('Cache-Control', 'ETag', 'Last-Modified', 'Vary')]
+        }
+
+    size = st.st_size
+    byte_range = requested_range(request, size, etag, last_modified)
+    if byte_range is False:
+        return {
+            'status': 416,
+            'headers': [('Content-Range', 'bytes */%d' % size)]
+        }
+
+    status = 200
+    if byte_range is not None:
+        start, end = byte_range
+        status = 206
+        headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end, size)))
+        size = end - start + 1
+    headers.append(('Content-Length', str(size)))
+
+    if request.get('request-method') == 'HEAD':
         return {
-            'status': 200,
+            'status': status,
             'headers': headers,
-            'body': FileWrapper(file)
+            'body': b''
         }
+
+    file = open(path, 'rb')
+    if byte_range is not None:
+        file.seek(byte_range[0])
+        body = FileWrapper(file, length=size)
+    elif 'wsgi.file_wrapper' in request:
+        body = request['wsgi.file_wrapper'](file, 8192)
+    else:
+        body = FileWrapper(file)
+
+    return {
+        'status': status,
+        'headers': headers,
+        'body': body
+    }
+
+def precompress_files(root, compresslevel=9, minimum_size=200):
+    '''Writes a gzipped `.gz` sidecar next to every compressible file under
+    root that is missing one or whose sidecar is older than the file.
+    Returns the paths of the sidecars written.
+
+    '''
+    written = []
+    for dirpath, dirnames, filenames in os.walk(str(root)):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if name.endswith('.gz') or not re_compressible.match(guess_mime(path)):
+                continue
+            st = stat_file(path)
+            if st is None or st.st_size < minimum_size:
+                continue
+            sidecar = stat_file(path + '.gz')
+            if sidecar is not None and sidecar.st_mtime_ns >= st.st_mtime_ns:
+                continue
+
+            with open(path, 'rb') as f:
+                compressed = gzip_buffer(f.read(), compresslevel)
+            if len(compressed) >= st.st_size:
+                continue
+            with open(path + '.gz', 'wb') as f:
+                f.write(compressed)
+            written.append(path + '.gz')
+    return written
+
+def file_response(path, defaultType=default_mime, precompressed=False):
+    path = str(path)
+    def response(request):
+        st = stat_file(path)
+        if st is None:
+            return None
+        return static_file_response(request, path, st, guess_mime(path, defaultType),
+                                    precompressed)
     return response
 
 from pathlib import Path
-def resource_response(root, default_file='', defaultType=default_mime):
-    root = Path(root)
+def resource_response(root, default_file='', defaultType=default_mime, precompressed=False):
+    root = Path(root).resolve()
 
-    print(dir(root))    
     def response(request):
         try:
-            path = request['path-info']
-            context = request.get('context', '')
-            full_path = root / path
-
-            if not os.path.isfile(full_path):
-                full_path =  root / default_file 
-                print(full_path)
-                if default_file == '' or not os.path.exists(full_path):
-                    return None 
-
-            extension = full_path.suffix
-            guessed_type = mimetypes.guess_type(full_path)
-            mime_type = extended_mimes.get(extension, guessed_type[0] or defaultType) 
-            file = open(full_path, 'rb')
-            file_size = os.path.getsize(full_path)
-        
-            headers = [('Content-Type', mime_type),
-                       ('Content-Length', str(file_size)),
-                       ('Cache-Control', 'public')]
-
-            return {
-                'status': 200,
-                'headers': headers,
-                'body': FileWrapper(file)
-            }
+            # path-info is absolute and would replace root when joined
+            path = (root / request['path-info'].lstrip('/')).resolve()
+            # .. segments must not escape root
+            if path != root and root not in path.parents:
+                return not_found_response(request)
+            full_path = str(path)
+            st = stat_file(full_path)
+
+            if st is None:
+                if default_file == '':
+                    return None
+                full_path = str(root / default_file)
+                st = stat_file(full_path)
+                if st is None:
+                    return None
+
+            return static_file_response(request, full_path, st,
+                                        guess_mime(full_path, defaultType),
+                                        precompressed)
         except  Exception as e:
             print(e)
 
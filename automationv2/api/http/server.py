@@ -1,5 +1,3 @@
-import time
-import json 
 from pathlib import Path
 from wsgiref.util import setup_testing_defaults
 from wsgiref.simple_server import make_server, WSGIServer
@@ -8,40 +6,39 @@ try:
 except:
     from SocketServer import ThreadingMixIn
 
-from .qroutes import GET, resource_response, wsgi_adapter, site_handler, not_found_response, file_response, GzipMiddleware, wrap_json_response, route_context
+from .qroutes import GET, resource_response, wsgi_adapter, site_handler, not_found_response, file_response, CompressionMiddleware, wrap_json_response, wrap_request_body, route_context
 from .navigation import rvt_tree_handler, get_file
 from . import tests
+from .events import EventHub, HubObserver, sse_handler
+from ...framework.observer import ObserverManager
 
 MODULE_DIR = Path(__file__).resolve().parent
-static_resources = resource_response(MODULE_DIR / "public", default_file='index.html')
+static_resources = resource_response(MODULE_DIR / "public", default_file='index.html', precompressed=True)
 
 def home_handler(request):
     print("HI FROM HOME")
     return {'status': 200,
             'body': b"HELLO WORLD"}
 
-def stream_handler(request):
-    def the_stream():
-        for i in xrange(10):
-            yield 'event: myevent\ndata: {}\n\n\n'.format(i, json.dumps(dict(name="Phillip")))
-            time.sleep(10)
-    return dict(
-        status = 200,
-        headers = [('Content-Type', 'text/event-stream')],
-        body = the_stream());
-    
+# procedure progress, executors running procedures for the UI notify `observers`.
+# An open /stream holds a server thread, runserver sets max_subscribers from its thread count
+event_hub = EventHub(max_subscribers=8)
+observers = ObserverManager()
+observers.add_observer(HubObserver(event_hub))
+
 routes = [
     GET('/api/home', home_handler),
     GET('/api/nav/tree/rvt', rvt_tree_handler),
     GET('/api/nav/file', get_file),
     route_context('/api', tests.routes),
-    GET('/stream', stream_handler),
+    GET('/stream', sse_handler(event_hub)),
     GET('/*', static_resources)
 ]
 app = site_handler(routes=routes, default_handler=not_found_response)
 app = wrap_json_response(app)
+app = wrap_request_body(app)
 app = wsgi_adapter(app)
-#app = GzipMiddleware(app)
+app = CompressionMiddleware(app)
 
 class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
     daemon_threads = True
@@ -1,8 +1,22 @@
+import asyncio
+from functools import partial
+
+def typed_key(args):
+    '''A hashable key for args that tells apart equal values of different
+    types, which a dict key would merge'''
+    return tuple((type(arg), arg) for arg in args)
+
 class BuildingBlock:
     ''' 
     The 'BuildingBlock' of the automation framework. Registers a function to
     be run during test execution.
     '''
+    # True when the block can run concurrently with other side effect free blocks
+    side_effect_free = False
+
+    # Seconds the block may run for, None to wait forever
+    timeout = None
+
     def name(self):
         '''Returns the name of the building block. The name is used
         as a first order lookup for the block'''
@@ -11,11 +25,26 @@ class BuildingBlock:
     def check_syntax(self, *args):
         '''Returns True if this BuildingBlock can support the arguments and False otherwise'''
         return True
+
+    def syntax_key(self, *args):
+        '''Returns a hashable key for the arguments, check_syntax is assumed to
+        give the same answer for arguments with the same key. By default
+        every argument value and its type, so 1, 1.0 and True differ. Blocks
+        whose syntax only depends on e.g. the number of arguments can return
+        a coarser key so more lookups are cached'''
+        return typed_key(args)
     
     def execute(self, *args):
         '''Executes the block. Returns a BlockResult'''
         return BlockResult(False)
 
+    async def execute_async(self, *args):
+        '''Executes the block on an event loop. Returns a BlockResult. By default
+        runs `execute` on the loop's default executor so a blocking block does
+        not stall the loop, blocks that only wait should override this'''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(self.execute, *args))
+
 class BlockResult:
     '''
     The result of executing a BuildingBlock
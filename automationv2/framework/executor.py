@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+
+from .blocks import BlockResult, BuildingBlock
+from .observer import ObserverManager
+
+
+def side_effect_free(block):
+    '''Marks a BuildingBlock class or instance as safe to run concurrently with
+    its neighbouring side effect free steps'''
+    block.side_effect_free = True
+    return block
+
+
+class Step:
+    '''
+    A BuildingBlock with the arguments it is executed with. `line` is the
+    source line reported to observers and `timeout` overrides the timeout of
+    the block.
+    '''
+    def __init__(self, block, args=(), line=None, timeout=None):
+        self.block = block
+        self.args = tuple(args)
+        self.line = line
+        self.timeout = timeout
+
+    def __repr__(self):
+        return '<Step: %s %r>' % (self.block.name(), self.args)
+
+
+class Parallel:
+    '''
+    Steps that run concurrently, the `(parallel ...)` form of a procedure.
+    Results are still reported in the order the steps are given.
+    '''
+    def __init__(self, *steps):
+        self.steps = steps
+
+
+def group_steps(steps):
+    '''Splits steps into lists that can run concurrently. Steps inside a
+    `Parallel` and runs of consecutive side effect free steps are grouped,
+    every other step is a group of its own'''
+    group = []
+    for step in steps:
+        if isinstance(step, Parallel):
+            if group:
+                yield group
+                group = []
+            yield list(step.steps)
+        elif getattr(step.block, 'side_effect_free', False):
+            group.append(step)
+        else:
+            if group:
+                yield group
+                group = []
+            yield [step]
+    if group:
+        yield group
+
+
+def step_timeout(step, default=None):
+    if step.timeout is not None:
+        return step.timeout
+    timeout = getattr(step.block, 'timeout', None)
+    return default if timeout is None else timeout
+
+
+def execute_block(block, args):
+    '''Executes a block, turning an exception into a failed BlockResult'''
+    try:
+        return block.execute(*args)
+    except Exception:
+        return BlockResult(False, stderr=traceback.format_exc())
+
+
+def timed_out(timeout):
+    return BlockResult(False, stderr='Timed out after %ss' % timeout)
+
+
+class Started:
+    '''Set by the worker that starts a step, so its timeout counts from then
+    rather than from when it was queued'''
+    def __init__(self):
+        self.event = threading.Event()
+        self.time = None
+
+    def set(self):
+        self.time = time.monotonic()
+        self.event.set()
+
+    def remaining(self, timeout):
+        self.event.wait()
+        return max(0, self.time + timeout - time.monotonic())
+
+
+def start_block(block, args, on_start):
+    '''Executes a block in a pool worker, calling `on_start` first'''
+    on_start()
+    return execute_block(block, args)
+
+
+def run_block(block, args, timeout=None):
+    '''Executes a block in the worker process that picked up the step, so a
+    timeout counts from when the step starts. A block that runs longer than
+    `timeout` fails. It can not be interrupted and is left to finish on a
+    daemon thread of that process'''
+    if timeout is None:
+        return execute_block(block, args)
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(execute_block(block, args)),
+                              name='block-%s' % block.name(), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if result:
+        return result[0]
+    return timed_out(timeout)
+
+
+class BlockExecutor:
+    '''
+    Runs the steps of a procedure on a pool of `max_workers` threads, or
+    processes when `processes` is True. Blocks must then be picklable.
+
+    Each group of `group_steps` is submitted together, and waits for the
+    groups before it.
+    A step that takes longer than its timeout fails. The timeout counts from
+    when a worker starts the step. A block can not be interrupted, a timed
+    out block keeps running and holds its worker until it returns, so
+    blocks never use more than `max_workers` threads. With processes the
+    block is left on a thread of the worker process, see `run_block`.
+
+    Observers are notified from the calling thread in step order, with the
+    index of the step as `step` so concurrent steps can be told apart, and
+    the `procedure` name given to the executor.
+    '''
+    def __init__(self, observers=None, max_workers=4, timeout=None,
+                 processes=False, stop_on_failure=True, procedure=None):
+        self.procedure = procedure
+        self.observers = observers if observers is not None else ObserverManager()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.processes = processes
+        self.stop_on_failure = stop_on_failure
+
+    def run(self, steps):
+        '''Runs `steps` and returns their BlockResults in order. With
+        `stop_on_failure` no steps are started after a group has failed'''
+        pool_class = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        results = []
+        pool = pool_class(max_workers=self.max_workers)
+        try:
+            for group in group_steps(steps):
+                group_results = self.run_group(pool, group, len(results))
+                results.extend(group_results)
+                if self.stop_on_failure and not all(group_results):
+                    break
+        finally:
+            # every result has been collected, only timed out blocks are still running
+            pool.shutdown(wait=False)
+        return results
+
+    def run_group(self, pool, group, first_index):
+        submitted = []
+        for index, step in enumerate(group, first_index):
+            self.observers.on_step_start(step=index, line=step.line, block=step.block.name(),
+                                         procedure=self.procedure)
+            timeout = step_timeout(step, self.timeout)
+            started = Started()
+            if self.processes:
+                future = pool.submit(run_block, step.block, step.args, timeout)
+            else:
+                future = pool.submit(start_block, step.block, step.args, started.set)
+            submitted.append((future, started, timeout))
+
+        results = []
+        for index, (step, (future, started, timeout)) in enumerate(zip(group, submitted), first_index):
+            try:
+                if self.processes or timeout is None:
+                    result = future.result()
+                else:
+                    result = future.result(started.remaining(timeout))
+            except TimeoutError:
+                result = timed_out(timeout)
+            except Exception:
+                # e.g. a block that could not be sent to a worker process
+                result = BlockResult(False, stderr=traceback.format_exc())
+            self.observers.on_step_end(step=index, line=step.line, result=result,
+                                       procedure=self.procedure)
+            results.append(result)
+        return results
+
+
+class AsyncBlockExecutor:
+    '''
+    Runs the steps of a procedure on an asyncio event loop. Blocks overriding
+    `execute_async` wait without holding a thread, legacy blocks run `execute`
+    on the loop's default executor. Steps are grouped like in BlockExecutor
+    and observers get the same events.
+    '''
+    def __init__(self, observers=None, timeout=None, stop_on_failure=True, procedure=None):
+        self.observers = observers if observers is not None else ObserverManager()
+        self.timeout = timeout
+        self.stop_on_failure = stop_on_failure
+        self.procedure = procedure
+
+    async def run(self, steps):
+        '''Runs `steps` and returns their BlockResults in order'''
+        results = []
+        for group in group_steps(steps):
+            group_results = await self.run_group(group, len(results))
+            results.extend(group_results)
+            if self.stop_on_failure and not all(group_results):
+                break
+        return results
+
+    async def run_step(self, step):
+        timeout = step_timeout(step, self.timeout)
+        try:
+            if type(step.block).execute_async is BuildingBlock.execute_async:
+                # a legacy block may wait for a free executor thread, its
+                # timeout starts once it runs. A timed out block keeps its thread
+                loop = asyncio.get_running_loop()
+                started = asyncio.Event()
+                def start():
+                    loop.call_soon_threadsafe(started.set)
+                future = loop.run_in_executor(None, start_block, step.block, step.args, start)
+                await started.wait()
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            # unlike a thread, a native async block is cancelled on timeout
+            return await asyncio.wait_for(step.block.execute_async(*step.args), timeout)
+        except asyncio.TimeoutError:
+            return timed_out(timeout)
+        except Exception:
+            return BlockResult(False, stderr=traceback.format_exc())
+
+    async def run_group(self, group, first_index):
+        for index, step in enumerate(group, first_index):
+            self.observers.on_step_start(step=index, line=step.line, block=step.block.name(),
+                                         procedure=self.procedure)
+        results = await asyncio.gather(*[self.run_step(step) for step in group])
+        for index, (step, result) in enumerate(zip(group, results), first_index):
+            self.observers.on_step_end(step=index, line=step.line, result=result,
+                                       procedure=self.procedure)
+        return results
+
+
+def run_procedures(procedures, observers=None, max_workers=4, timeout=None):
+    '''
+    Runs every procedure in `procedures`, a dict of name to steps,
+    concurrently on one event loop and returns a dict of name to results.
+    Legacy sync blocks share a pool of `max_workers` threads.
+    '''
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=max_workers))
+        names = list(procedures)
+        executors = [AsyncBlockExecutor(observers, timeout, procedure=name) for name in names]
+        results = await asyncio.gather(*[executor.run(procedures[name])
+                                         for executor, name in zip(executors, names)])
+        return dict(zip(names, results))
+    return asyncio.run(main())
@@ -1,3 +1,6 @@
+import threading
+import traceback
+from collections import deque
 from functools import partial
   
 class Observer():
@@ -6,14 +9,35 @@ class Observer():
 class ObserverManager(object):
     def __init__(self):
         self.observers = set()
+        # event name -> tuple of (handler, observer), built on first notify
+        self.handlers = {}
     
     def add_observer(self, observer):
         self.observers.add(observer)
+        self.handlers.clear()
+        
+    def remove_observer(self, observer):
+        self.observers.discard(observer)
+        self.handlers.clear()
+        
+    def handlers_for(self, event):
+        '''Builds the handlers subscribed to `event`. An observer subscribes to
+        every event it has an 'on_' method for, or only to the events listed in
+        its `events` attribute if it has one'''
+        name = 'on_' + event
+        handlers = self.handlers[event] = tuple(
+            (getattr(observer, name), observer)
+            for observer in self.observers
+            if event in getattr(observer, 'events', (event,)) and hasattr(observer, name))
+        return handlers
         
     def notify(self, event, *args, **kwargs):
-        for observer in self.observers:
-            if hasattr(observer, 'on_' + event):
-                getattr(observer, 'on_' + event)(observer, *args, **kwargs)
+        try:
+            handlers = self.handlers[event]
+        except KeyError:
+            handlers = self.handlers_for(event)
+        for handler, observer in handlers:
+            handler(observer, *args, **kwargs)
             
     def __getattr__(self, name):
         if name.startswith('on_'):
@@ -28,4 +52,136 @@ class ObserverManager(object):
     def on_step_start(self, *args, **kwargs):                  self.notify('step_start', *args, **kwargs)
     def on_step_end(self, *args, **kwargs):                    self.notify('step_end', *args, **kwargs)
     def on_procedure_end(self, *args, **kwargs):               self.notify('procedure_end', *args, **kwargs)
-    def on_comment(self, *args, **kwargs):                     self.notify('comment', *args, **kwargs)
\ No newline at end of file
+    def on_comment(self, *args, **kwargs):                     self.notify('comment', *args, **kwargs)
+
+
+class BackgroundObserverManager(ObserverManager):
+    '''
+    Delivers events to observers in batches on a background thread, so a slow
+    observer does not stall the procedure. At most `maxsize` events wait to be
+    delivered, when that is reached the `overflow` policy decides:
+
+    'block'        notify waits until there is room
+    'drop-oldest'  the oldest waiting event is dropped
+    'coalesce'     a waiting event with the same name is replaced by the new
+                   one, otherwise the oldest waiting event is dropped
+
+    A procedure_end event is a barrier, it is never dropped or coalesced and
+    no event is coalesced across it. It waits until it and every event before
+    it have been delivered. Once closed, events are delivered on the notifying
+    thread.
+    '''
+    overflow_policies = ('block', 'drop-oldest', 'coalesce')
+    barriers = ('procedure_end',)
+
+    def __init__(self, maxsize=1000, overflow='block', batch_size=100):
+        super().__init__()
+        if overflow not in self.overflow_policies:
+            raise ValueError(f'Unknown overflow policy {overflow}, expected one of {self.overflow_policies}')
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.queued = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # the number of the first event of the batch being delivered
+        self.delivering = None
+        self.closed = False
+        self.thread = None
+
+    def notify(self, event, *args, **kwargs):
+        with self.condition:
+            if not self.closed and len(self.pending) >= self.maxsize:
+                if self.overflow == 'block':
+                    # an observer notifying from the delivery thread can't wait for itself
+                    if threading.current_thread() is not self.thread:
+                        self.condition.wait_for(lambda: len(self.pending) < self.maxsize or self.closed)
+                elif (self.overflow == 'coalesce' and event not in self.barriers
+                      and self.coalesce(event, args, kwargs)):
+                    return
+                else:
+                    self.drop_oldest()
+            queued = not self.closed
+            if queued:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.deliver, name='observer-delivery', daemon=True)
+                    self.thread.start()
+                self.queued += 1
+                self.pending.append((self.queued, event, args, kwargs))
+                self.condition.notify_all()
+        if not queued:
+            # the delivery thread has stopped
+            ObserverManager.notify(self, event, *args, **kwargs)
+        elif event == 'procedure_end':
+            self.flush()
+
+    def coalesce(self, event, args, kwargs):
+        '''Replaces the newest waiting `event` after the last barrier, returns
+        False if there is none'''
+        for index in range(len(self.pending) - 1, -1, -1):
+            number, name = self.pending[index][:2]
+            if name in self.barriers:
+                return False
+            if name == event:
+                self.pending[index] = (number, event, args, kwargs)
+                self.coalesced += 1
+                return True
+        return False
+
+    def drop_oldest(self):
+        '''Drops the oldest waiting event that is not a barrier. When every
+        waiting event is a barrier the queue goes over `maxsize` instead'''
+        for index, (number, event, args, kwargs) in enumerate(self.pending):
+            if event not in self.barriers:
+                del self.pending[index]
+                self.dropped += 1
+                return
+
+    def deliver(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending:
+                    return
+                batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+                self.delivering = batch[0][0]
+                self.condition.notify_all()
+
+            for number, event, args, kwargs in batch:
+                try:
+                    ObserverManager.notify(self, event, *args, **kwargs)
+                except Exception:
+                    # one failing observer must not stop delivery to the others
+                    traceback.print_exc()
+
+            with self.condition:
+                self.delivered += len(batch)
+                self.delivering = None
+                self.condition.notify_all()
+
+    def oldest(self):
+        '''The number of the oldest event not yet delivered or dropped'''
+        if self.delivering is not None:
+            return self.delivering
+        return self.pending[0][0] if self.pending else self.queued + 1
+
+    def flush(self, timeout=None):
+        '''Waits until every event notified so far has been delivered or dropped.
+        Returns False on timeout'''
+        if threading.current_thread() is self.thread:
+            return False
+        with self.condition:
+            queued = self.queued
+            # events are numbered, drops of later events must not count
+            return self.condition.wait_for(lambda: self.oldest() > queued, timeout)
+
+    def close(self):
+        '''Delivers the waiting events and stops the background thread'''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,110 @@
+from time import perf_counter
+
+from .blocks import typed_key
+from .executor import Step
+
+
+class BlockNotFound(LookupError):
+    pass
+
+
+class BlockRegistry:
+    '''
+    Indexes BuildingBlocks by name. Resolving a step looks up the candidates
+    for its name and returns the first, in registration order, whose
+    `check_syntax` accepts the arguments.
+
+    `check_syntax` outcomes are cached per block and `syntax_key` of the
+    arguments, and the chosen block per name and `typed_key` of the
+    arguments. Registering or removing a block drops the cached dispatch for
+    its name. Each cache is cleared when it reaches `maxsize` entries, so
+    arguments that are rarely repeated don't grow it without bound.
+    '''
+    def __init__(self, blocks=(), maxsize=10000):
+        self.maxsize = maxsize
+        self.blocks = {}
+        self.syntax_cache = {}
+        self.dispatch = {}
+        self.lookups = 0
+        self.hits = 0
+        self.syntax_checks = 0
+        self.lookup_time = 0.0
+        for block in blocks:
+            self.register(block)
+
+    def register(self, block):
+        name = block.name()
+        self.blocks.setdefault(name, []).append(block)
+        self.invalidate(name)
+        return block
+
+    def unregister(self, block):
+        name = block.name()
+        self.blocks[name].remove(block)
+        if not self.blocks[name]:
+            del self.blocks[name]
+        self.syntax_cache = {key: value for key, value in self.syntax_cache.items()
+                             if key[0] is not block}
+        self.invalidate(name)
+
+    def invalidate(self, name):
+        self.dispatch = {key: block for key, block in self.dispatch.items()
+                         if key[0] != name}
+
+    def candidates(self, name):
+        return self.blocks.get(name, [])
+
+    def check_syntax(self, block, args):
+        try:
+            key = (block, block.syntax_key(*args))
+            return self.syntax_cache[key]
+        except KeyError:
+            self.syntax_checks += 1
+            if len(self.syntax_cache) >= self.maxsize:
+                self.syntax_cache.clear()
+            accepted = self.syntax_cache[key] = bool(block.check_syntax(*args))
+            return accepted
+        except TypeError:
+            # unhashable arguments are checked every time
+            self.syntax_checks += 1
+            return bool(block.check_syntax(*args))
+
+    def resolve(self, name, *args):
+        '''Returns the block to run for `name` with `args`. Raises
+        BlockNotFound if no block accepts them'''
+        start = perf_counter()
+        self.lookups += 1
+        try:
+            key = (name, typed_key(args))
+            try:
+                block = self.dispatch[key]
+                self.hits += 1
+                return block
+            except KeyError:
+                cacheable = True
+            except TypeError:
+                cacheable = False
+
+            for block in self.candidates(name):
+                if self.check_syntax(block, args):
+                    if cacheable:
+                        if len(self.dispatch) >= self.maxsize:
+                            self.dispatch.clear()
+                        self.dispatch[key] = block
+                    return block
+            raise BlockNotFound(f'No block {name} accepts arguments {args}')
+        finally:
+            self.lookup_time += perf_counter() - start
+
+    def load(self, lines):
+        '''Resolves every `(name, args, line)` of a procedure up front and
+        returns the Steps to run'''
+        return [Step(self.resolve(name, *args), args, line) for name, args, line in lines]
+
+    def stats(self):
+        return {'lookups': self.lookups,
+                'hits': self.hits,
+                'syntax_checks': self.syntax_checks,
+                'lookup_time': self.lookup_time,
+                'mean_lookup_time': self.lookup_time / self.lookups if self.lookups else 0.0,
+                'blocks': sum(len(blocks) for blocks in self.blocks.values())}
@@ -0,0 +1,63 @@
+'''Runs many procedures that mostly wait, concurrently in one process.
+
+Each procedure polls an instrument a few times with an async wait step and
+runs one legacy sync step. With a thread per procedure this would need as
+many threads as procedures, here they share one event loop and a small pool
+for the sync steps. Run from the project root:
+
+    python -m benchmarks.procedures
+'''
+import asyncio
+import threading
+import time
+
+from automationv2.framework.blocks import BlockResult, BuildingBlock
+from automationv2.framework.executor import Step, run_procedures
+
+
+class Wait(BuildingBlock):
+    async def execute_async(self, seconds):
+        await asyncio.sleep(seconds)
+        return BlockResult(True)
+
+
+class Record(BuildingBlock):
+    '''A legacy block, run on the executor's threads'''
+    def execute(self, value):
+        time.sleep(0.01)
+        return BlockResult(True, stdout=str(value))
+
+
+def build_procedure(polls, seconds):
+    steps = [Step(Wait(), [seconds]) for _ in range(polls)]
+    steps.append(Step(Record(), ['done']))
+    return steps
+
+
+def main(counts=(10, 100, 500), polls=5, seconds=0.2, max_workers=4):
+    print('%10s %10s %10s %12s' % ('procedures', 'seconds', 'serial', 'max threads'))
+    for count in counts:
+        procedures = {'procedure-%d' % i: build_procedure(polls, seconds) for i in range(count)}
+        threads = [threading.active_count()]
+        sampler = threading.Event()
+
+        def sample():
+            while not sampler.wait(0.05):
+                threads.append(threading.active_count())
+        thread = threading.Thread(target=sample)
+        thread.start()
+
+        start = time.perf_counter()
+        results = run_procedures(procedures, max_workers=max_workers)
+        elapsed = time.perf_counter() - start
+        sampler.set()
+        thread.join()
+
+        assert all(all(result) for result in results.values())
+        serial = count * (polls * seconds + 0.01)
+        # less the main and sampler threads
+        print('%10d %10.2f %10.1f %12d' % (count, elapsed, serial, max(threads) - 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''Micro-benchmark for resolving the steps of a procedure to BuildingBlocks.
+
+Compares scanning every block and calling `check_syntax` on each step with
+`BlockRegistry.load`. Run from the project root:
+
+    python -m benchmarks.registry
+'''
+import random
+import time
+
+from automationv2.framework.blocks import BuildingBlock
+from automationv2.framework.registry import BlockRegistry
+
+
+class Block(BuildingBlock):
+    '''A block named `name` accepting `arity` arguments that parse as numbers'''
+    def __init__(self, name, arity):
+        self._name = name
+        self.arity = arity
+
+    def name(self):
+        return self._name
+
+    def check_syntax(self, *args):
+        if len(args) != self.arity:
+            return False
+        try:
+            [float(arg) for arg in args]
+            return True
+        except ValueError:
+            return False
+
+
+def build_blocks(names, arities=(0, 1, 2, 3)):
+    return [Block('block-%d' % i, arity) for i in range(names) for arity in arities]
+
+
+def build_procedure(steps, names, seed=0):
+    random.seed(seed)
+    lines = []
+    for i in range(steps):
+        arity = random.randint(0, 3)
+        args = tuple(str(random.randint(0, 20)) for _ in range(arity))
+        lines.append(('block-%d' % random.randrange(names), args, 'line %d' % i))
+    return lines
+
+
+def scan_resolve(blocks, name, args):
+    for block in blocks:
+        if block.name() == name and block.check_syntax(*args):
+            return block
+
+
+def main(names=200, steps=5000):
+    blocks = build_blocks(names)
+    lines = build_procedure(steps, names)
+
+    start = time.perf_counter()
+    scanned = [scan_resolve(blocks, name, args) for name, args, _ in lines]
+    scan_time = time.perf_counter() - start
+
+    registry = BlockRegistry(blocks)
+    start = time.perf_counter()
+    loaded = registry.load(lines)
+    load_time = time.perf_counter() - start
+    assert [step.block for step in loaded] == scanned
+
+    start = time.perf_counter()
+    registry.load(lines)
+    reload_time = time.perf_counter() - start
+
+    print('%d steps, %d blocks' % (steps, len(blocks)))
+    print('%14s %10.2f ms' % ('scan', scan_time * 1e3))
+    print('%14s %10.2f ms' % ('registry', load_time * 1e3))
+    print('%14s %10.2f ms' % ('registry again', reload_time * 1e3))
+    print(registry.stats())
+
+
+if __name__ == '__main__':
+    main()
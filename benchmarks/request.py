@@ -0,0 +1,68 @@
+'''Micro-benchmark for turning a WSGI environ into a ring request.
+
+Compares copying the environ into a dict with `wsgi_environ_to_ring_request`
+against the lazy `Request` used by `wsgi_adapter`, both behind
+`wrap_query_params` as in the server. One request only reads its method and
+uri, the other also reads headers and query params. Run from the project
+root:
+
+    python -m benchmarks.request
+'''
+import io
+import timeit
+from wsgiref.util import setup_testing_defaults
+
+from automationv2.api.http.qroutes import (Request, wrap_query_params,
+                                           wsgi_environ_to_ring_request)
+
+
+def build_environ(headers=20):
+    "A browser-like GET request with `headers` extra headers"
+    environ = {'PATH_INFO': '/api/queue/changes',
+               'QUERY_STRING': 'since=10&wait=5',
+               'wsgi.input': io.BytesIO()}
+    setup_testing_defaults(environ)
+    environ.update({'HTTP_X_CUSTOM_HEADER_%d' % i: 'value %d' % i for i in range(headers)})
+    environ.update({'HTTP_ACCEPT_ENCODING': 'gzip, deflate',
+                    'HTTP_USER_AGENT': 'Mozilla/5.0',
+                    'HTTP_IF_NONE_MATCH': '"abc"'})
+    return environ
+
+
+def route_only(request):
+    return request.get('request-method'), request.get('uri')
+
+
+def full(request):
+    return (request.get('request-method'), request.get('uri'),
+            request['headers'].get('Accept-Encoding'), request['query-params'].get('since'))
+
+
+parse = wrap_query_params(lambda request: request)
+
+
+def eager(environ):
+    return parse(wsgi_environ_to_ring_request(environ))
+
+
+def lazy(environ):
+    return parse(Request(environ))
+
+
+def main(headers=(0, 20, 50), number=20000):
+    print('%8s %12s %14s %14s %8s' % ('headers', 'access', 'dict (us)', 'lazy (us)', 'speedup'))
+    for count in headers:
+        environ = build_environ(count)
+        assert full(eager(environ)) == full(lazy(environ))
+        for name, access in (('route', route_only), ('full', full)):
+            before = timeit.timeit(lambda: access(eager(environ)),
+                                   number=number)
+            after = timeit.timeit(lambda: access(lazy(environ)), number=number)
+            print('%8d %12s %14.2f %14.2f %7.1fx' % (count, name,
+                                                     before / number * 1e6,
+                                                     after / number * 1e6,
+                                                     before / after))
+
+
+if __name__ == '__main__':
+    main()
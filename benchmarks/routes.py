@@ -0,0 +1,67 @@
+'''Micro-benchmark for route dispatch in `qroutes.site_handler`.
+
+Compares the old linear scan over every compiled route with the prefix tree
+dispatcher as the number of routes grows. Run from the project root:
+
+    python -m benchmarks.routes
+'''
+import timeit
+
+from automationv2.api.http.qroutes import (RouteDispatcher, make_route,
+                                           method_matches, route_compile)
+
+
+def build_routes(count):
+    "Builds `count` routes spread over contexts, half literal and half with :params"
+    routes = []
+    for i in range(count):
+        context = '/api/ctx%d' % (i % 20)
+        if i % 2:
+            path = '/items%d/:id' % i
+        else:
+            path = '/items%d/list' % i
+        route = make_route('GET', path, i)
+        route['full_path'] = context + path
+        route['context'] = context
+        route['compiled'] = route_compile(route['full_path'])
+        routes.append(route)
+    return routes
+
+
+def linear_match(routes, request):
+    for route in routes:
+        if method_matches(request, route.get('method', None)):
+            params = route['compiled'].route_matches(request)
+            if params is not None:
+                return route, params
+
+
+def trie_match(dispatcher, request):
+    for match in dispatcher.matches(request):
+        return match
+
+
+def main(sizes=(10, 100, 500, 1000, 5000), number=2000):
+    print('%8s %14s %14s %8s' % ('routes', 'linear (us)', 'trie (us)', 'speedup'))
+    for size in sizes:
+        routes = build_routes(size)
+        dispatcher = RouteDispatcher()
+        for route in routes:
+            dispatcher.add(route)
+
+        # Worst case for the linear scan: the last registered route
+        last = routes[-1]
+        uri = last['full_path'].replace(':id', '42')
+        request = {'uri': uri, 'request-method': 'GET'}
+        assert linear_match(routes, request)[0] is trie_match(dispatcher, request)[0]
+
+        linear = timeit.timeit(lambda: linear_match(routes, request), number=number)
+        trie = timeit.timeit(lambda: trie_match(dispatcher, request), number=number)
+        print('%8d %14.2f %14.2f %7.1fx' % (size,
+                                            linear / number * 1e6,
+                                            trie / number * 1e6,
+                                            linear / trie))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,8 +25,8 @@ def read(stream_or_str, sentinel=None):
         stream = stream_or_str
     
     for ch in stream:
-        if is_whitespace(ch): continue
         if ch is None: return READ_EOF
+        if is_whitespace(ch): continue
         if ch == sentinel: return READ_FINISHED
         
         # Possibly need 1 lookahead
@@ -44,34 +44,120 @@ def read(stream_or_str, sentinel=None):
                 return form
         else: 
             return read_symbol(stream, ch)
+    return READ_EOF
 #cell
 
 def is_whitespace(ch):  return ch in ' \t\n,'
 def is_ending(ch):      return ch in '";@^`()[]{}\\'
 #cell
 
+import sys
+from collections.abc import MutableMapping
+
+span_keys = ('start_row', 'start_col', 'ending_row', 'ending_col')
+
+class Span(MutableMapping):
+    "Rows and columns a form was read from, with the interface of a `meta` dict"
+    __slots__ = span_keys + ('extra',)
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key) if key in span_keys else self.extra[key]
+        except AttributeError:
+            raise KeyError(key) from None
+        
+    def __setitem__(self, key, value):
+        if key in span_keys:
+            setattr(self, key, value)
+        elif hasattr(self, 'extra'):
+            self.extra[key] = value
+        else:
+            self.extra = {key: value}
+            
+    def __delitem__(self, key):
+        try:
+            if key in span_keys:
+                delattr(self, key)
+            else:
+                del self.extra[key]
+        except AttributeError:
+            raise KeyError(key) from None
+            
+    def __iter__(self):
+        for key in span_keys:
+            if hasattr(self, key):
+                yield key
+        yield from getattr(self, 'extra', ())
+        
+    def __len__(self):
+        return sum(1 for _ in self)
+    
+    def copy(self):
+        span = Span()
+        for key in span_keys:
+            if hasattr(self, key):
+                setattr(span, key, getattr(self, key))
+        if hasattr(self, 'extra'):
+            span.extra = dict(self.extra)
+        return span
+    
+    def __repr__(self):
+        return repr(dict(self))
+#cell
+
+class SymbolKey:
+    "The interned identity of a symbol"
+    __slots__ = ('name', 'namespace', 'qualified', 'hash')
+    
+    def __init__(self, name, namespace=None):
+        self.name = sys.intern(name)
+        self.namespace = None if namespace is None else sys.intern(namespace)
+        self.qualified = self.name if namespace is None else sys.intern(f"{namespace}/{name}")
+        self.hash = hash(self.qualified)
+        
+    def __reduce__(self):
+        # copies and unpickled keys must be the interned one
+        return (intern_symbol, (self.name, self.namespace))
+    
+    def __repr__(self):
+        return f"SymbolKey({self.qualified!r})"
+
+symbol_table = {}
+
+def intern_symbol(name, namespace=None):
+    "Returns the `SymbolKey` for a name and namespace"
+    key = symbol_table.get((namespace, name))
+    if key is None:
+        key = symbol_table.setdefault((namespace, name), SymbolKey(name, namespace))
+    return key
+#cell
+
 class Symbol(str):
     def __new__(cls, val, *args, **kwargs):
         return str.__new__(cls, val)
 
     def __init__(self, val, namespace=None):
-        self.namespace = namespace
-        self.meta = {}
+        self.key = intern_symbol(str(val), namespace)
+        self.meta = Span()
         
     def __eq__(self, val):
-        if isinstance(val, type(self)):
-            return super().__eq__(val) and self.namespace == val.namespace
+        if isinstance(val, Symbol):
+            return self.key is val.key
         elif isinstance(val, str):
-            if self.namespace is not None:
-                return f"{self.namespace}/{self}" == val
-            else:
-                return super().__eq__(val)
+            return self.key.qualified == val
         return False
     
+    def __ne__(self, val):
+        return not self.__eq__(val)
+    
     @property
     def name(self):
         return self
     
+    @property
+    def namespace(self):
+        return self.key.namespace
+    
     def __repr__(self):
         if self.namespace is None:
             return self
@@ -79,7 +165,7 @@ class Symbol(str):
             return f"{self.namespace}/{self}"
         
     def __hash__(self):
-        return hash(str(self))
+        return self.key.hash
 #cell
 
 def is_special(ch):     return ch in '-+.'
@@ -345,9 +431,11 @@ def match_ratio(s):
     return int(numerator) / int(denominator)
 #cell
 class List(list):
+    __slots__ = ('meta',)
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.meta = {}
+        self.meta = Span()
 
 def read_list(stream, initch):
     starting_info = stream.starting_line_col_info()
@@ -382,8 +470,16 @@ def read_delimited(stream, initch, sentinel):
 macros['('] = read_list
         
 #cell
-class Vector(List):
-    pass
+class Vector(list):
+    __slots__ = ('meta',)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.meta = Span()
+        
+    def assoc(self, i, value):
+        "Returns a persistent copy of the vector with value at index i"
+        return utils.PersistentVector(self, self.meta).assoc(i, value)
 
 def read_vector(stream, initch):
     starting_info = stream.starting_line_col_info()
@@ -402,9 +498,19 @@ def read_vector(stream, initch):
 macros['['] = read_vector
 #cell
 class Map(dict):
+    __slots__ = ('meta',)
+    
     def __init__(self, vals, linerange=None):
         dict.__init__(self, vals)
-        self.meta = {}
+        self.meta = Span()
+        
+    def assoc(self, key, value):
+        "Returns a persistent copy of the map with key mapped to value"
+        return utils.PersistentMap(self, self.meta).assoc(key, value)
+    
+    def dissoc(self, key):
+        "Returns a persistent copy of the map without key"
+        return utils.PersistentMap(self, self.meta).dissoc(key)
     
 def read_map(stream, initch):
     starting_info = stream.starting_line_col_info()
@@ -436,9 +542,15 @@ def read_dispatch(stream, initch):
 macros['#'] = read_dispatch 
 
 class Set(set):
+    __slots__ = ('meta',)
+    
     def __init__(self, *vals):
         set.__init__(self, vals)
-        self.meta = {}
+        self.meta = Span()
+        
+    def __reduce__(self):
+        # set's own __reduce__ passes the items as one argument and ignores slots
+        return (type(self), tuple(self), (None, {'meta': self.meta}))
         
 def read_set(stream, initch):
     starting_info = stream.starting_line_col_info()
@@ -467,3 +579,516 @@ def read_comment(stream, initch):
     # macros ignore the form.
     return stream
 macros[';'] = read_comment
+#cell
+
+def read_quote(stream, initch):
+    form = read(stream)
+    if form == READ_EOF:
+        raise Exception("EOF after quote")
+    return List([Symbol('quote'), form])
+macros["'"] = read_quote
+#cell
+
+import bisect
+
+# whitespace followed by either a token or a single delimiter character
+form_pattern = re.compile(r'[ \t\n,]*(?:([^ \t\n,";@^`()\[\]{}\\]+)([ \t\n,]?)|([^ \t\n,]))')
+token_pattern = re.compile(r'[^ \t\n,";@^`()\[\]{}\\]*')
+string_chunk_pattern = re.compile(r'[^"\\]*')
+separators = {' ', '\t', '\n', ','}
+
+class UseStreamReader(Exception):
+    "Raised by `SourceReader` for input only the stream reader handles"
+    
+class ReaderEOF(Exception):
+    "Raised when the source ends in the middle of a form"
+
+class SourceReader:
+    "Reads forms from a string by scanning the whole buffer"
+    def __init__(self, source, row=0, col=0, final=True):
+        self.source = source
+        self.pos = 0
+        self.newlines = None
+        
+        # where source starts in the file, and whether more of the file follows
+        self.row = row
+        self.col = col
+        self.final = final
+        
+    def attach_line_col(self, form, start, end):
+        "Sets the line/col meta of a form read from offsets `start` to `end`"
+        if self.newlines is None:
+            self.newlines = [-1 - self.col] + [m.start() for m in re.finditer('\n', self.source)]
+        newlines = self.newlines
+        
+        start_row = bisect.bisect_left(newlines, start) - 1
+        ending_row = bisect.bisect_left(newlines, end, start_row + 1) - 1
+        span = form.meta
+        span.start_row = start_row + self.row
+        span.start_col = start - newlines[start_row] - 1
+        span.ending_row = ending_row + self.row
+        span.ending_col = end - newlines[ending_row] - 1
+        return form
+    
+    def need_more(self, end):
+        "Stops reading a form that runs to `end` when more of the source is still to come"
+        if end >= len(self.source) and not self.final:
+            raise ReaderEOF("EOF in middle of form")
+    
+    def token_end(self, start):
+        "Returns the end of the token at `start` and the position after it is read"
+        end = token_pattern.match(self.source, start).end()
+        self.need_more(end)
+        if self.source[end:end+1] in separators:
+            return end, end + 1
+        return end, end
+    
+    def read(self, sentinel=None):
+        source = self.source
+        while True:
+            m = form_pattern.match(source, self.pos)
+            if m is None:
+                self.pos = len(source)
+                return READ_EOF
+            
+            token, separator, ch = m.groups()
+            if token is None:
+                start = m.start(3)
+                self.pos = start + 1
+                if ch == sentinel: return READ_FINISHED
+            else:
+                self.need_more(m.end(1))
+                start = m.start(1)
+                ch = token[0]
+                if ch.isdecimal() or (ch in '-+' and token[1:2].isdecimal()):
+                    self.pos = m.end(1)
+                    return match_number(token)
+                elif ch == ':':
+                    return self.read_keyword(start, m.end(1), m.end())
+                self.pos = start + 1
+            
+            if ch in source_macros:
+                form = source_macros[ch](self, start)
+                
+                # comments return the reader itself
+                if form is not self:
+                    return form
+            elif token is None:
+                return self.read_symbol(start, start, start + 1)
+            else:
+                return self.read_symbol(start, m.end(1), m.end())
+            
+    def read_delimited(self, sentinel):
+        forms = []
+        while True:
+            form = self.read(sentinel)
+            if form is READ_EOF:
+                raise ReaderEOF("EOF in middle of list")
+            elif form is READ_FINISHED:
+                return forms
+            else:
+                forms.append(form)
+    
+    def read_symbol(self, start, end, pos):
+        self.pos = pos
+        token = self.source[start:end]
+        
+        # Special Symbols
+        if token == 'nil': return None
+        elif token == 'true': return True
+        elif token == 'false': return False
+        elif token == '/': return Symbol('/')
+        
+        ns, name = parse_symbol(token)
+        return self.attach_line_col(Symbol(name, ns), start, pos)
+    
+    def read_keyword(self, start, end, pos):
+        if end == start + 1 and (end == len(self.source) or self.source[end] in separators):
+            raise Exception('Single colon not allowed')
+        
+        self.pos = pos
+        ns, kw = parse_symbol(self.source[start+1:end])
+        
+        if ns is not None and ns.startswith(':'):
+            raise Exception('Namespace alias not supported')
+        
+        return self.attach_line_col(Keyword(kw, ns), start, pos)
+    
+    def read_string(self, start):
+        source = self.source
+        pos = start + 1
+        parts = []
+        while True:
+            end = string_chunk_pattern.match(source, pos).end()
+            parts.append(source[pos:end])
+            if end >= len(source):
+                raise ReaderEOF("EOF in middle of string")
+            elif source[end] == '"':
+                self.pos = end + 1
+                return ''.join(parts)
+            
+            # escapes are rare, reuse the stream reader for anything but simple ones
+            self.need_more(end + 1)
+            ch = source[end+1:end+2] or None
+            pos = end + 2
+            if ch in escape_chars:
+                parts.append(escape_chars[ch])
+            elif ch == 'u':
+                self.need_more(pos + 3)
+                chars = utils.PushBackCharStream(source[pos:pos+4])
+                parts.append(read_unicode_char(chars, base=16, length=4))
+                pos += 4
+            elif is_numeric(ch):
+                self.need_more(pos + 1)
+                chars = utils.PushBackCharStream(source[pos-1:pos+2])
+                parts.append(read_unicode_char(chars, base=8, length=3))
+                pos += 2
+            else:
+                raise Exception("Invalid escape '\\{}'".format(ch))
+    
+    def read_char(self, start):
+        source = self.source
+        pos = start + 1
+        if pos >= len(source):
+            raise ReaderEOF("EOF in character")
+        
+        ch = source[pos]
+        if is_whitespace(ch):
+            raise Exception("Backslash cannot be followed by whitespace")
+        
+        if is_ending(ch):
+            token = ch
+            self.pos = pos + 1
+        else:
+            end, self.pos = self.token_end(pos)
+            token = source[pos:end]
+        
+        if len(token) == 1:        ch = token
+        elif token == "newline":   ch = '\n'
+        elif token == 'space':     ch = ' '
+        elif token == 'tab':       ch = '\t'
+        elif token == 'backspace': ch = '\b'
+        elif token == 'formfeed':  ch = '\f'
+        elif token == 'return':    ch = '\r'
+        elif token.startswith('u'):
+            # the stream reader reads exactly 4 characters after the u, even
+            # past the end of the token
+            if len(token) != 5:
+                raise UseStreamReader("Invalid character escape '{}'".format(token))
+            ch = read_unicode_char(utils.PushBackCharStream(token[1:]), base=16, length=4)
+        elif token.startswith('o'):
+            ch = read_unicode_char(utils.PushBackCharStream(token[1:]), base=8, length=len(token)-1)
+        else:
+            raise Exception("Invalid character escape '{}'".format(token))
+        
+        return ch
+    
+    def read_list(self, start):
+        forms = self.read_delimited(')')
+        return self.attach_line_col(List(forms), start, self.pos)
+    
+    def read_vector(self, start):
+        forms = self.read_delimited(']')
+        return self.attach_line_col(Vector(forms), start, self.pos)
+    
+    def read_map(self, start):
+        forms = self.read_delimited('}')
+        
+        assert len(forms) % 2 == 0, "Map must have value for every key"
+        
+        pairs = [forms[i:i+2] for i in range(0, len(forms), 2)]
+        return self.attach_line_col(Map(pairs), start, self.pos)
+    
+    def read_dispatch(self, start):
+        self.need_more(start + 1)
+        ch = self.source[start+1:start+2]
+        if ch in source_dispatch_macros:
+            self.pos = start + 2
+            return source_dispatch_macros[ch](self, start + 1)
+        raise Exception("Invalid Dispatch")
+    
+    def read_set(self, start):
+        forms = self.read_delimited('}')
+        theset = self.attach_line_col(Set(*forms), start, self.pos)
+        theset.meta['start_col'] -= 1
+        return theset
+    
+    def read_comment(self, start):
+        end = self.source.find('\n', start)
+        self.pos = len(self.source) if end == -1 else end + 1
+        return self
+    
+    def read_quote(self, start):
+        form = self.read()
+        if form is READ_EOF:
+            raise ReaderEOF("EOF after quote")
+        return List([Symbol('quote'), form])
+
+source_macros = {
+    '"': SourceReader.read_string,
+    '\\': SourceReader.read_char,
+    '(': SourceReader.read_list,
+    '[': SourceReader.read_vector,
+    '{': SourceReader.read_map,
+    '#': SourceReader.read_dispatch,
+    ';': SourceReader.read_comment,
+    "'": SourceReader.read_quote,
+}
+source_dispatch_macros = {
+    '{': SourceReader.read_set,
+}
+
+# the macros SourceReader knows how to read
+builtin_macros = dict(macros)
+builtin_dispatch_macros = dict(dispatch_macros)
+
+read_stream = read
+
+def read(stream_or_str, sentinel=None):
+    if (isinstance(stream_or_str, str) and 
+        macros == builtin_macros and 
+        dispatch_macros == builtin_dispatch_macros):
+        try:
+            return SourceReader(stream_or_str).read(sentinel)
+        except UseStreamReader:
+            pass
+    
+    return read_stream(stream_or_str, sentinel)
+#cell
+
+import hashlib
+import marshal
+import os
+import threading
+from collections import OrderedDict
+
+def read_forms(source):
+    "Reads every top level form in the string `source`, falling back to the stream reader like `read`"
+    if macros == builtin_macros and dispatch_macros == builtin_dispatch_macros:
+        reader = SourceReader(source)
+        forms = []
+        try:
+            while True:
+                form = reader.read()
+                if form is READ_EOF:
+                    return forms
+                forms.append(form)
+        except UseStreamReader:
+            pass
+    
+    stream = utils.PushBackCharStream(source)
+    forms = []
+    while True:
+        form = read_stream(stream)
+        if form is READ_EOF:
+            return forms
+        forms.append(form)
+        
+def dump_meta(meta):
+    if tuple(meta) == span_keys:
+        return tuple(meta.values())
+    return dict(meta) or None
+
+def load_meta(form, meta):
+    if isinstance(meta, tuple):
+        form.meta.update(zip(span_keys, meta))
+    elif meta:
+        form.meta.update(meta)
+    return form
+
+def dump_form(form):
+    "Converts a form to nested tuples of builtin types that `marshal` can write"
+    if isinstance(form, Keyword):
+        return ('k', str(form), form.namespace, dump_meta(form.meta))
+    elif isinstance(form, Symbol):
+        return ('s', str(form), form.namespace, dump_meta(form.meta))
+    elif isinstance(form, List):
+        return ('l', [dump_form(f) for f in form], dump_meta(form.meta))
+    elif isinstance(form, Vector):
+        return ('v', [dump_form(f) for f in form], dump_meta(form.meta))
+    elif isinstance(form, Map):
+        return ('m', [dump_form(f) for kv in form.items() for f in kv], dump_meta(form.meta))
+    elif isinstance(form, Set):
+        return ('S', [dump_form(f) for f in form], dump_meta(form.meta))
+    return form
+
+def load_form(data):
+    "Rebuilds a form written by `dump_form`"
+    if not isinstance(data, tuple):
+        return data
+    
+    tag, value, *rest = data
+    if tag == 'k':
+        return load_meta(Keyword(value, rest[0]), rest[1])
+    elif tag == 's':
+        return load_meta(Symbol(value, rest[0]), rest[1])
+    
+    forms = [load_form(f) for f in value]
+    if tag == 'l':
+        form = List(forms)
+    elif tag == 'v':
+        form = Vector(forms)
+    elif tag == 'm':
+        form = Map([forms[i:i+2] for i in range(0, len(forms), 2)])
+    else:
+        form = Set(*forms)
+    return load_meta(form, rest[0])
+
+def copy_form(form):
+    "Copies the lists, vectors, maps and sets of a form with their meta. Atoms are shared"
+    if isinstance(form, List):
+        copy = List([copy_form(f) for f in form])
+    elif isinstance(form, Vector):
+        copy = Vector([copy_form(f) for f in form])
+    elif isinstance(form, Map):
+        # keys are hashable, so they aren't collections that can change
+        copy = Map([(k, copy_form(v)) for k, v in form.items()])
+    elif isinstance(form, Set):
+        copy = Set(*form)
+    else:
+        return form
+    copy.meta = form.meta.copy()
+    return copy
+
+class ParseCache:
+    """Caches the forms read from files, in memory and optionally on disk.
+    Every read returns a `copy_form` of the cached forms, so one caller
+    changing its forms doesn't change them for the others"""
+    
+    # bump when the reader or the serialized format changes
+    version = b'1'
+    
+    def __init__(self, maxsize=256, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        
+    def read(self, path):
+        "Returns a new list of the top level forms in the file at `path`"
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        
+        with self.lock:
+            entry = self.entries.get(path)
+            unchanged = entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size)
+            if unchanged:
+                self.entries.move_to_end(path)
+                self.hits += 1
+        if unchanged:
+            return [copy_form(form) for form in entry[3]]
+        
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(self.version + data).hexdigest()
+        
+        if entry is not None and entry[2] == digest:
+            forms, counter = entry[3], 'hits'
+        else:
+            forms, counter = self.load(digest), 'disk_hits'
+            if forms is None:
+                forms, counter = read_forms(data.decode('utf-8').replace('\r\n', '\n')), 'misses'
+                self.dump(digest, forms)
+        
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self.entries[path] = (st.st_mtime_ns, st.st_size, digest, forms)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return [copy_form(form) for form in forms]
+    
+    def disk_path(self, digest):
+        return os.path.join(self.directory, digest + '.forms')
+    
+    def load(self, digest):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.disk_path(digest), 'rb') as f:
+                return [load_form(form) for form in marshal.load(f)]
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        
+    def dump(self, digest, forms):
+        if self.directory is None:
+            return
+        path = self.disk_path(digest)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        try:
+            with open(tmp, 'wb') as f:
+                marshal.dump([dump_form(form) for form in forms], f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+        
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        
+    def stats(self):
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+                'maxsize': self.maxsize}
+#cell
+
+import codecs
+import io
+
+def iter_forms(path_or_fileobj, chunk_size=1 << 16):
+    "Yields the top level forms in a file as they are read"
+    if isinstance(path_or_fileobj, (str, os.PathLike)):
+        with open(path_or_fileobj, encoding='utf-8') as f:
+            yield from iter_forms(f, chunk_size)
+        return
+    
+    f = path_or_fileobj
+    decoder = None if isinstance(f, io.TextIOBase) else codecs.getincrementaldecoder('utf-8')()
+    
+    buffer = ''
+    row, col = 0, 0
+    size = chunk_size
+    final = False
+    while not final:
+        chunk = f.read(size)
+        final = not chunk
+        if decoder is not None:
+            chunk = decoder.decode(chunk, final=final)
+        buffer += chunk
+        
+        reader = SourceReader(buffer, row, col, final=final)
+        consumed = 0
+        while True:
+            try:
+                form = reader.read()
+            except ReaderEOF:
+                if final: raise
+                break
+            if form is READ_EOF:
+                break
+            yield form
+            consumed = reader.pos
+        
+        # drop what has been read, remembering where the rest starts
+        done, buffer = buffer[:consumed], buffer[consumed:]
+        newlines = done.count('\n')
+        if newlines:
+            row += newlines
+            col = len(done) - done.rfind('\n') - 1
+        else:
+            col += len(done)
+        
+        # a form didn't fit, read more at a time until it does
+        size = chunk_size if consumed else size * 2
+
+def read_all(path_or_fileobj, chunk_size=1 << 16):
+    "Reads every top level form in a file"
+    return list(iter_forms(path_or_fileobj, chunk_size))
@@ -0,0 +1,129 @@
+import json
+
+from automationv2.api.http import server
+from automationv2.api.http.events import EventHub, EventStream, last_event_id, sse_handler
+from automationv2.framework.blocks import BlockResult, BuildingBlock
+from automationv2.framework.executor import BlockExecutor, Step
+
+
+def parse(payload):
+    "The (id, event, data) of each event in an encoded stream"
+    events = []
+    for block in payload.decode('utf-8').split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n')
+                      if line and not line.startswith(':'))
+        if 'data' in fields:
+            events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_publish_and_take():
+    hub = EventHub()
+    subscription = hub.subscribe()
+    hub.publish('step_end', {'step': 1})
+    hub.publish('step_end', {'step': 2})
+    events = hub.take(subscription, timeout=0)
+    assert [event.id for event in events] == [1, 2]
+    assert parse(events[0].payload) == [(1, 'step_end', {'step': 1})]
+    assert hub.take(subscription, timeout=0) == []
+
+    hub.unsubscribe(subscription)
+    hub.publish('step_end', {'step': 3})
+    assert hub.take(subscription, timeout=0) == []
+
+
+def test_slow_subscriber_drops_its_oldest_events():
+    hub = EventHub(buffer_size=3)
+    slow, fast = hub.subscribe(), hub.subscribe()
+    for step in range(5):
+        hub.publish('step_end', {'step': step})
+        hub.take(fast, timeout=0)
+    assert [event.id for event in hub.take(slow, timeout=0)] == [3, 4, 5]
+    assert slow.dropped == 2 and fast.dropped == 0
+
+
+def test_last_event_id_replays_the_history():
+    hub = EventHub(history=3)
+    for step in range(5):
+        hub.publish('step_end', {'step': step})
+    assert [event.id for event in hub.take(hub.subscribe(last_event_id=3), timeout=0)] == [4, 5]
+    # older events have left the history
+    assert [event.id for event in hub.replay(0)] == [3, 4, 5]
+    assert hub.replay(None) == []
+
+    assert last_event_id({'headers': {'Last-Event-Id': '7'}}) == 7
+    assert last_event_id({'headers': {'Last-Event-Id': 'x'}}) is None
+    assert last_event_id({'headers': {}}) is None
+
+
+def test_stream():
+    hub = EventHub()
+    hub.publish('step_end', {'step': 1})
+    stream = hub.stream(last_event_id=0, heartbeat=0.01, linger=0.2, retry=500)
+    assert isinstance(stream, EventStream) and len(hub.subscriptions) == 1
+    chunks = iter(stream)
+    assert next(chunks) == b'retry: 500\nid: 0\n\n'
+    assert parse(next(chunks)) == [(1, 'step_end', {'step': 1})]
+    assert next(chunks) == b': heartbeat\n\n'
+    hub.publish('comment', {'text': 'hi'})
+    rest = b''.join(chunks)
+    assert parse(rest) == [(2, 'comment', {'text': 'hi'})]
+    assert len(hub.subscriptions) == 0
+
+
+def test_closing_an_unread_stream_unsubscribes():
+    hub = EventHub()
+    stream = hub.stream()
+    assert len(hub.subscriptions) == 1
+    stream.close()
+    assert len(hub.subscriptions) == 0
+
+
+def test_full_hub_sends_missed_events_without_holding_a_thread():
+    hub = EventHub(max_subscribers=1)
+    held = hub.stream()
+    hub.publish('step_end', {'step': 1})
+    hub.publish('step_end', {'step': 2})
+
+    body = sse_handler(hub)({'headers': {'Last-Event-Id': '1'}})['body']
+    assert isinstance(body, list)
+    assert body[0].startswith(b'retry: 5000\nid: 1\n\n')
+    assert parse(body[0]) == [(2, 'step_end', {'step': 2})]
+    assert len(hub.subscriptions) == 1
+
+    # a client without an id is told the latest one
+    assert sse_handler(hub)({'headers': {}})['body'] == [b'retry: 5000\nid: 2\n\n']
+
+    held.close()
+    assert isinstance(hub.stream(), EventStream)
+
+
+def test_reconnecting_without_an_id_resumes_from_the_preamble():
+    hub = EventHub()
+    hub.publish('step_end', {'step': 1})
+    chunks = iter(hub.stream(heartbeat=0.01, linger=0.05))
+    fields = dict(line.split(': ', 1) for line in next(chunks).decode('utf-8').split('\n') if line)
+    assert fields['id'] == '1'
+    assert b''.join(chunks).count(b'heartbeat') >= 1
+
+    # published while the client waits to reconnect after linger
+    hub.publish('step_end', {'step': 2})
+    request = {'headers': {'Last-Event-Id': fields['id']}}
+    chunks = iter(sse_handler(hub, heartbeat=0.01, linger=0.05)(request)['body'])
+    next(chunks)
+    assert parse(b''.join(chunks)) == [(2, 'step_end', {'step': 2})]
+
+
+class Pass(BuildingBlock):
+    def execute(self):
+        return BlockResult(True)
+
+
+def test_server_observers_publish_to_the_stream():
+    start = server.event_hub.last_id
+    BlockExecutor(server.observers, procedure='p').run([Step(Pass(), line=3)])
+    events = [(event.name, json.loads(event.payload.decode('utf-8').split('data: ')[1]))
+              for event in server.event_hub.replay(start)]
+    assert [name for name, _ in events] == ['step_start', 'step_end']
+    assert events[0][1] == {'step': 0, 'line': 3, 'block': 'Pass', 'procedure': 'p'}
+    assert events[1][1]['result'].startswith('<BlockResult: PASS')
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+
+from automationv2.framework.blocks import BlockResult, BuildingBlock
+from automationv2.framework.executor import (AsyncBlockExecutor, BlockExecutor, Parallel, Step,
+                                             run_procedures, side_effect_free, step_timeout)
+from automationv2.framework.observer import ObserverManager
+
+
+class Sleep(BuildingBlock):
+    def execute(self, seconds, value=None):
+        time.sleep(seconds)
+        return BlockResult(True, stdout=str(value))
+
+
+@side_effect_free
+class Pure(Sleep):
+    pass
+
+
+class Fail(BuildingBlock):
+    def execute(self):
+        return BlockResult(False, stderr='failed')
+
+
+class Raise(BuildingBlock):
+    def execute(self):
+        raise ValueError('broken block')
+
+
+class Wait(BuildingBlock):
+    async def execute_async(self, seconds):
+        await asyncio.sleep(seconds)
+        return BlockResult(True)
+
+
+class Recorder:
+    def __init__(self):
+        self.seen = []
+        self.lock = threading.Lock()
+
+    def on_step_start(self, observer, step, line, block, procedure):
+        with self.lock:
+            self.seen.append(('start', step, procedure))
+
+    def on_step_end(self, observer, step, line, result, procedure):
+        with self.lock:
+            self.seen.append(('end', step, procedure))
+
+
+def observed():
+    recorder = Recorder()
+    observers = ObserverManager()
+    observers.add_observer(recorder)
+    return recorder, observers
+
+
+def test_results_and_events_in_step_order():
+    recorder, observers = observed()
+    steps = [Step(Sleep(), [0.05, 'a']), Step(Sleep(), [0, 'b'])]
+    results = BlockExecutor(observers, procedure='p').run(steps)
+    assert [result.stdout for result in results] == ['a', 'b']
+    assert recorder.seen == [('start', 0, 'p'), ('end', 0, 'p'), ('start', 1, 'p'), ('end', 1, 'p')]
+
+
+def test_parallel_groups_run_concurrently():
+    recorder, observers = observed()
+    steps = [Parallel(*[Step(Sleep(), [0.2, i]) for i in range(4)]),
+             Step(Pure(), [0.2, 4]), Step(Pure(), [0.2, 5]),
+             Step(Sleep(), [0, 6])]
+    start = time.monotonic()
+    results = BlockExecutor(observers, max_workers=4).run(steps)
+    assert time.monotonic() - start < 0.8
+    assert [result.stdout for result in results] == [str(i) for i in range(7)]
+    # a group is started together and reported in order
+    assert [event[:2] for event in recorder.seen[:8]] == (
+        [('start', i) for i in range(4)] + [('end', i) for i in range(4)])
+
+
+def test_errors_fail_the_step_and_stop_the_procedure():
+    results = BlockExecutor().run([Step(Raise()), Step(Sleep(), [0])])
+    assert len(results) == 1 and not results[0]
+    assert 'broken block' in results[0].stderr
+
+    results = BlockExecutor(stop_on_failure=False).run([Step(Fail()), Step(Sleep(), [0])])
+    assert [bool(result) for result in results] == [False, True]
+
+
+def test_timeout_counts_from_when_the_step_starts():
+    # six steps queued behind one worker, each well inside its own timeout
+    steps = [Parallel(*[Step(Sleep(), [0.1, i], timeout=0.3) for i in range(6)])]
+    results = BlockExecutor(max_workers=1).run(steps)
+    assert all(results), [result.stderr for result in results]
+
+    results = BlockExecutor(timeout=0.1).run([Step(Sleep(), [1])])
+    assert not results[0] and results[0].stderr == 'Timed out after 0.1s'
+
+
+class Running(BuildingBlock):
+    running = 0
+    most = 0
+    lock = threading.Lock()
+
+    def execute(self, seconds):
+        with self.lock:
+            Running.running += 1
+            Running.most = max(Running.most, Running.running)
+        time.sleep(seconds)
+        with self.lock:
+            Running.running -= 1
+        return BlockResult(True)
+
+
+def test_timed_out_blocks_hold_their_worker():
+    threads = threading.active_count()
+    steps = [Parallel(*[Step(Running(), [0.3]) for i in range(6)])]
+    start = time.monotonic()
+    results = BlockExecutor(max_workers=2, timeout=0.05).run(steps)
+    assert not any(results)
+    # the later steps waited for a worker freed by a timed out block
+    assert time.monotonic() - start >= 0.3
+    assert Running.most == 2 and threading.active_count() <= threads + 2
+
+
+def test_explicit_zero_timeout_is_kept():
+    block = Sleep()
+    block.timeout = 0
+    assert step_timeout(Step(block), default=5) == 0
+    assert step_timeout(Step(Sleep()), default=5) == 5
+    assert step_timeout(Step(block, timeout=1), default=5) == 1
+
+
+def test_async_executor():
+    recorder, observers = observed()
+    steps = [Step(Wait(), [0.05]), Step(Sleep(), [0, 'sync']), Step(Wait(), [1], timeout=0.1)]
+    results = asyncio.run(AsyncBlockExecutor(observers, procedure='p').run(steps))
+    assert [bool(result) for result in results] == [True, True, False]
+    assert results[1].stdout == 'sync'
+    assert results[2].stderr == 'Timed out after 0.1s'
+    assert [event[:2] for event in recorder.seen] == [
+        ('start', 0), ('end', 0), ('start', 1), ('end', 1), ('start', 2), ('end', 2)]
+
+
+def test_run_procedures():
+    recorder, observers = observed()
+    procedures = {'p%d' % i: [Step(Wait(), [0.1]), Step(Sleep(), [0.1, i], timeout=0.25)]
+                  for i in range(8)}
+    start = time.monotonic()
+    results = run_procedures(procedures, observers, max_workers=2)
+    assert time.monotonic() - start < 2
+    # sync steps queue for the two threads without timing out
+    assert all(all(steps) for steps in results.values())
+    assert [result.stdout for result in results['p3']] == ['', '3']
+    assert sorted(event[2] for event in recorder.seen if event[0] == 'end') == sorted(
+        name for name in procedures for _ in range(2))
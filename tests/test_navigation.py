@@ -0,0 +1,75 @@
+from automationv2.api.http import navigation
+from automationv2.api.http.navigation import TreeIndex
+
+
+def make_tree(root, files):
+    for name in files:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+
+
+def test_subtree(tmp_path):
+    make_tree(tmp_path, ['a.txt', 'sub/b.txt', 'sub/deep/c.txt'])
+    index = TreeIndex([str(tmp_path)])
+    index.refresh()
+
+    assert set(index.subtree()) == {'rvt', 'rvt/a.txt', 'rvt/sub', 'rvt/sub/b.txt',
+                                    'rvt/sub/deep', 'rvt/sub/deep/c.txt'}
+    assert set(index.subtree(None, 0)) == {'rvt'}
+    assert set(index.subtree(None, 1)) == {'rvt', 'rvt/a.txt', 'rvt/sub'}
+    assert set(index.subtree('rvt/sub', 1)) == {'rvt/sub', 'rvt/sub/b.txt', 'rvt/sub/deep'}
+    assert index.subtree('rvt/missing') == {}
+
+
+def test_refresh_sees_changes(tmp_path):
+    make_tree(tmp_path, ['a.txt'])
+    index = TreeIndex([str(tmp_path)])
+    version = index.refresh()
+    etag = index.etag()
+
+    assert index.refresh(force=True) == version
+    assert index.etag() == etag
+
+    make_tree(tmp_path, ['sub/b.txt'])
+    assert index.refresh(force=True) == version + 1
+    assert 'rvt/sub/b.txt' in index.subtree()
+    assert index.etag() != etag
+
+
+def test_etag_depends_on_tree_and_query(tmp_path):
+    make_tree(tmp_path / 'one', ['a.txt'])
+    make_tree(tmp_path / 'two', ['b.txt'])
+    one = TreeIndex([str(tmp_path / 'one')])
+    two = TreeIndex([str(tmp_path / 'two')])
+    one.refresh()
+    two.refresh()
+    assert one.version == two.version
+    assert one.etag() != two.etag()
+
+    # the same tree gives the same ETag in a new process
+    again = TreeIndex([str(tmp_path / 'one')])
+    again.refresh()
+    assert again.etag() == one.etag()
+    assert one.etag('rvt', 1) != one.etag('rvt', 2)
+
+
+def test_rvt_tree_handler(tmp_path, monkeypatch):
+    make_tree(tmp_path, ['a.txt', 'sub/b.txt'])
+    monkeypatch.setattr(navigation, 'rvt_index', TreeIndex([str(tmp_path)]))
+
+    response = navigation.rvt_tree_handler({'query-string': 'depth=0'})
+    assert response['status'] == 200
+    assert set(response['body']) == {'rvt'}
+    etag = dict(response['headers'])['ETag']
+
+    response = navigation.rvt_tree_handler({'query-string': 'depth=0',
+                                            'headers': {'If-None-Match': etag}})
+    assert response['status'] == 304
+    assert 'body' not in response
+
+    response = navigation.rvt_tree_handler({'query-string': 'depth=1',
+                                            'headers': {'If-None-Match': etag}})
+    assert response['status'] == 200
+
+    assert navigation.rvt_tree_handler({'query-string': 'path=rvt/missing'})['status'] == 404
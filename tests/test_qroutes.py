@@ -0,0 +1,241 @@
+import gzip
+import io
+import os
+
+import pytest
+
+from automationv2.api.http.qroutes import (GET, POST, BodyReader, Request, RequestBodyError,
+                                           RequestBodyTooLarge, RouteDispatcher, context, file_response,
+                                           make_route, method_matches, resource_response, route_compile,
+                                           route_context, site_handler, wrap_request_body)
+
+
+def test_resource_response_stays_in_root(tmp_path):
+    root = tmp_path / 'public'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'index.html').write_bytes(b'index')
+    (root / 'sub' / 'page.html').write_bytes(b'page')
+    (tmp_path / 'secret.txt').write_bytes(b'secret')
+    handler = resource_response(root, default_file='index.html')
+
+    def get(path):
+        return handler({'path-info': path, 'request-method': 'GET', 'headers': {}})
+
+    assert get('/sub/page.html')['status'] == 200
+    assert get('/sub/../index.html')['status'] == 200
+    assert get('/../secret.txt')['status'] == 404
+    assert get('/sub/../../secret.txt')['status'] == 404
+    assert get('/../../../../../../etc/passwd')['status'] == 404
+    # unknown files inside root fall back to the default file
+    assert get('/missing.html')['status'] == 200
+
+
+class UnreadInput(io.BytesIO):
+    def read(self, *args):
+        raise AssertionError('the body was read')
+
+
+def make_request(body=b'', **environ):
+    environ = dict({'REQUEST_METHOD': 'POST', 'PATH_INFO': '/queue', 'QUERY_STRING': 'a=1&a=2&b=3',
+                    'CONTENT_TYPE': 'text/plain', 'CONTENT_LENGTH': str(len(body)),
+                    'HTTP_ACCEPT_ENCODING': 'gzip', 'wsgi.input': io.BytesIO(body),
+                    'wsgi.url_scheme': 'http'}, **environ)
+    return Request(environ)
+
+
+def test_request_reads_ring_keys_from_the_environ():
+    request = make_request()
+    assert request['request-method'] == 'POST'
+    assert request['uri'] == request['path-info'] == '/queue'
+    assert request['scheme'] == 'http'
+    assert request['headers'] == {'Content-Type': 'text/plain', 'Content-Length': '0',
+                                  'Accept-Encoding': 'gzip'}
+    assert request['query-params'] == {'a': '2', 'b': '3'}
+    assert request['query-params-list'] == [('a', '1'), ('a', '2'), ('b', '3')]
+
+
+def test_request_hides_remapped_environ_keys():
+    request = make_request()
+    for key in ['REQUEST_METHOD', 'PATH_INFO', 'CONTENT_TYPE', 'HTTP_ACCEPT_ENCODING', 'wsgi.url_scheme']:
+        assert key not in request
+        assert key not in list(request)
+        with pytest.raises(KeyError):
+            request[key]
+        assert request.get(key) is None
+    assert 'server-port' not in request and request.get('server-port', 80) == 80
+
+
+def test_request_contains():
+    request = make_request()
+    assert 'request-method' in request and 'wsgi.input' in request
+    assert 'headers' in request and 'body' in request
+    assert 'missing' not in request
+    request['missing'] = 1
+    assert 'missing' in request
+
+
+def test_request_is_a_mapping_over_the_environ():
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    request = make_request(**environ)
+    request['config'] = {'debug': True}
+    request['path-info'] = '/sub'
+    assert request['path-info'] == '/sub' and request['uri'] == '/'
+    assert request.environ['PATH_INFO'] == '/', 'the environ is never changed'
+
+    copy = dict(request)
+    assert len(copy) == len(request) and set(copy) == set(request.keys())
+    assert copy['config'] == {'debug': True} and copy['headers']['Accept-Encoding'] == 'gzip'
+    assert copy == dict(request.items())
+
+    del request['config']
+    assert 'config' not in request
+    with pytest.raises(KeyError):
+        del request['uri']
+
+
+def test_request_copies_leave_the_body_unread():
+    request = make_request(**{'wsgi.input': UnreadInput(b'data'), 'CONTENT_LENGTH': '4'})
+    assert 'body' not in dict(request) and 'body' not in {**request}
+    assert 'body' not in dict(request.items())
+
+    # once read it is listed
+    request = make_request(b'data')
+    assert request['body'] == b'data'
+    assert dict(request)['body'] == b'data'
+
+
+def test_request_lists_the_body_reader():
+    seen = {}
+
+    def handler(request):
+        seen.update(request)
+        return {'status': 200, 'body': request['body'].read()}
+
+    request = make_request(b'data')
+    assert wrap_request_body(handler)(request)['body'] == b'data'
+    assert seen['body'] is request['body']
+
+
+def test_precompressed_sidecar_is_only_served_while_fresh(tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_bytes(b'old' * 100)
+    (tmp_path / 'app.js.gz').write_bytes(gzip.compress(b'old' * 100))
+    handler = file_response(path, precompressed=True)
+    gzip_request = {'request-method': 'GET', 'headers': {'Accept-Encoding': 'gzip'}}
+
+    response = handler(gzip_request)
+    assert dict(response['headers'])['Content-Encoding'] == 'gzip'
+    response['body'].close()
+
+    # edited after the sidecar was written
+    path.write_bytes(b'new' * 100)
+    gz_mtime = os.stat(str(tmp_path / 'app.js.gz')).st_mtime_ns
+    os.utime(str(path), ns=(gz_mtime + 10**9, gz_mtime + 10**9))
+    response = handler(gzip_request)
+    headers = dict(response['headers'])
+    assert 'Content-Encoding' not in headers and headers['Content-Length'] == '300'
+    assert b''.join(response['body']) == b'new' * 100
+
+
+def test_not_modified_keeps_vary(tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_bytes(b'x' * 300)
+    handler = file_response(path, precompressed=True)
+    etag = dict(handler({'request-method': 'GET', 'headers': {}})['headers'])['ETag']
+
+    response = handler({'request-method': 'GET', 'headers': {'If-None-Match': etag}})
+    assert response['status'] == 304
+    headers = dict(response['headers'])
+    assert headers['Vary'] == 'Accept-Encoding' and headers['ETag'] == etag
+
+
+def test_json_lines_are_parsed_as_they_are_read():
+    body = b'{"job": 1}\n\n[2]\n"three"'
+    reader = BodyReader(io.BytesIO(body), len(body), max_memory=16, chunk_size=4)
+    assert list(reader.json_lines()) == [{'job': 1}, [2], 'three']
+
+    # a whole document over max_memory is refused, the same lines are not
+    body = b'{"job": 1}\n' * 10
+    with pytest.raises(RequestBodyTooLarge):
+        BodyReader(io.BytesIO(body), len(body), max_memory=16).json()
+    assert len(list(BodyReader(io.BytesIO(body), len(body), max_memory=16).json_lines())) == 10
+
+    with pytest.raises(RequestBodyError, match='line 2'):
+        list(BodyReader(io.BytesIO(b'1\n[2\n'), 5).json_lines())
+
+
+def linear_matches(routes, request):
+    "The matcher site_handler used before RouteDispatcher, every route in order"
+    for route in routes:
+        if method_matches(request, route.get('method')):
+            params = route['compiled'].route_matches(request)
+            if params is not None:
+                yield route, params
+
+
+def test_dispatcher_matches_routes_in_the_order_of_a_linear_scan():
+    routes = [GET('/', 'index'), GET('/api/home', 'home'), POST('/api/home', 'post home'),
+              GET('/api/:id', 'item'), GET('/api/:id/runs/:run', 'run'), GET('/api/', 'api'),
+              make_route(None, '/api/any', 'any method'), GET('/files/*', 'files'),
+              GET('/api/home/', 'home slash'), GET('/*', 'static')]
+    dispatcher = RouteDispatcher()
+    for route in routes:
+        route['compiled'] = route_compile(route['path'])
+        dispatcher.add(route)
+
+    for method in ['GET', 'HEAD', 'POST', 'PUT']:
+        for uri in ['/', '', '/api', '/api/', '/api/home', '/api/home/', '/api/any', '/api/7/runs/3',
+                    '/api/7/runs', '/files', '/files/', '/files/a/b.txt', '/missing/deep/path', '/api//home']:
+            request = {'request-method': method, 'uri': uri}
+            expected = [(r['handler'], p) for r, p in linear_matches(routes, request)]
+            assert [(r['handler'], p) for r, p in dispatcher.matches(request)] == expected, (method, uri)
+
+
+def route_handler(routes, default_handler=None):
+    def handle(method, uri):
+        return handler({'request-method': method, 'uri': uri, 'path-info': uri})
+    handler = site_handler(routes, default_handler)
+    return handle
+
+
+def test_head_falls_back_to_get():
+    handle = route_handler([GET('/page', lambda request: 'get'), POST('/page', lambda request: 'post')])
+    assert handle('HEAD', '/page') == 'get'
+    assert handle('POST', '/page') == 'post'
+    assert handle('PUT', '/page') is None
+
+
+def test_trailing_slash():
+    handle = route_handler([GET('/dir/', lambda request: 'dir'), GET('/page', lambda request: 'page')])
+    assert handle('GET', '/dir') == handle('GET', '/dir/') == 'dir'
+    assert handle('GET', '/page') == 'page'
+    assert handle('GET', '/page/') is None
+
+
+def test_handlers_returning_none_fall_through():
+    calls = []
+
+    def skip(request):
+        calls.append(request['params'])
+
+    handle = route_handler([GET('/items/:id', skip), GET('/items/:id', lambda request: request['params']['id']),
+                            GET('/*', lambda request: 'static')],
+                           default_handler=lambda request: 'default')
+    assert handle('GET', '/items/3') == '3'
+    assert calls == [{'id': '3'}]
+    assert handle('GET', '/other') == 'static'
+    assert route_handler([GET('/a', skip)], default_handler=lambda request: 'default')('GET', '/a') == 'default'
+
+
+def test_routes_nested_under_contexts():
+    def seen(request):
+        return request['context'], request['path-info'], request['params']
+
+    api = context('/api')
+    api.GET('/tests/:id')(seen)
+    routes = [route_context('/v1', api.routes, GET('/', seen)), GET('/api/tests/:id', lambda request: 'top')]
+    handle = route_handler(routes)
+    assert handle('GET', '/v1/api/tests/5') == ('/v1/api', '/tests/5', {'id': '5'})
+    assert handle('GET', '/v1/') == ('/v1', '/', {})
+    assert handle('GET', '/v1') == ('/v1', '', {})
+    assert handle('GET', '/api/tests/5') == 'top'
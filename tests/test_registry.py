@@ -0,0 +1,94 @@
+import pytest
+
+from automationv2.framework.blocks import BuildingBlock
+from automationv2.framework.registry import BlockNotFound, BlockRegistry
+
+
+class Typed(BuildingBlock):
+    '''A block named Set accepting one argument of exactly `kind`'''
+    def __init__(self, kind):
+        self.kind = kind
+
+    def name(self):
+        return 'Set'
+
+    def check_syntax(self, *args):
+        return len(args) == 1 and type(args[0]) is self.kind
+
+
+class Arity(BuildingBlock):
+    '''A block whose syntax only depends on the number of arguments'''
+    def check_syntax(self, *args):
+        return len(args) == 2
+
+    def syntax_key(self, *args):
+        return len(args)
+
+
+def test_cache_hits_and_misses():
+    block = Typed(int)
+    registry = BlockRegistry([block])
+    assert registry.resolve('Set', 1) is block
+    assert registry.resolve('Set', 1) is block
+    assert registry.stats()['lookups'] == 2
+    assert registry.hits == 1 and registry.syntax_checks == 1
+
+    assert registry.resolve('Set', 2) is block
+    assert registry.hits == 1 and registry.syntax_checks == 2
+
+    with pytest.raises(BlockNotFound):
+        registry.resolve('Set', 'text')
+    with pytest.raises(BlockNotFound):
+        registry.resolve('Missing', 1)
+
+
+def test_equal_values_of_different_types_are_cached_apart():
+    ints, floats, bools = Typed(int), Typed(float), Typed(bool)
+    registry = BlockRegistry([ints, floats, bools])
+    for _ in range(2):
+        assert registry.resolve('Set', 1) is ints
+        assert registry.resolve('Set', 1.0) is floats
+        assert registry.resolve('Set', True) is bools
+
+    registry = BlockRegistry([ints])
+    registry.resolve('Set', 1)
+    with pytest.raises(BlockNotFound):
+        registry.resolve('Set', True)
+    with pytest.raises(BlockNotFound):
+        registry.resolve('Set', 1.0)
+
+
+def test_register_and_unregister_invalidate_the_name():
+    ints, floats = Typed(int), Typed(float)
+    registry = BlockRegistry([ints])
+    with pytest.raises(BlockNotFound):
+        registry.resolve('Set', 1.0)
+
+    registry.register(floats)
+    assert registry.resolve('Set', 1.0) is floats
+    assert registry.resolve('Set', 1) is ints
+
+    registry.unregister(floats)
+    with pytest.raises(BlockNotFound):
+        registry.resolve('Set', 1.0)
+    assert registry.resolve('Set', 1) is ints
+
+
+def test_caches_are_bounded():
+    registry = BlockRegistry([Typed(int)], maxsize=10)
+    for value in range(100):
+        registry.resolve('Set', value)
+    assert len(registry.dispatch) <= 10
+    assert len(registry.syntax_cache) <= 10
+
+
+def test_coarse_syntax_key_and_unhashable_arguments():
+    block = Arity()
+    registry = BlockRegistry([block])
+    for value in range(20):
+        assert registry.resolve('Arity', value, str(value)) is block
+    assert registry.syntax_checks == 1
+
+    assert registry.resolve('Arity', [1], {'a': 1}) is block
+    assert registry.resolve('Arity', [1], {'a': 1}) is block
+    assert registry.hits == 0
@@ -0,0 +1,45 @@
+from wsgiref.util import setup_testing_defaults
+
+from automationv2.api.http.server import app
+
+
+def call(path, **headers):
+    environ = {'PATH_INFO': path}
+    environ.update(('HTTP_' + name.upper().replace('-', '_'), value)
+                   for name, value in headers.items())
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = dict(headers)
+
+    body = app(environ, start_response)
+    response['body'] = b''.join(chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                                for chunk in body)
+    if hasattr(body, 'close'):
+        body.close()
+    return response
+
+
+def test_conditional_get_through_compression():
+    for path in ('/index.html', '/api/nav/tree/rvt'):
+        response = call(path, accept_encoding='gzip')
+        assert response['status'] == '200 OK'
+        assert response['headers']['Content-Encoding'] == 'gzip'
+        etag = response['headers']['ETag']
+        assert etag.endswith(';gzip"')
+
+        response = call(path, accept_encoding='gzip', if_none_match=etag)
+        assert response['status'].startswith('304'), path
+        assert response['headers']['ETag'] == etag
+        assert response['body'] == b''
+
+        # an uncompressed client validates the plain ETag
+        plain = call(path)['headers']['ETag']
+        assert plain == etag.replace(';gzip', '')
+        assert call(path, if_none_match=plain)['status'].startswith('304')
+
+
+def test_static_paths_stay_in_public():
+    assert call('/../../../../../../etc/passwd')['status'].startswith('404')